@@ -0,0 +1,188 @@
+"""Awaitable versions of the db.py calls.
+
+Every call runs on one dedicated executor thread that owns the shared sqlite
+connection, so coroutines never block the event loop on disk I/O. Reads of
+a channel's plans are served from channel_cache, which every write here
+keeps up to date.
+"""
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import db
+import metrics
+from channel_cache import ChannelCache
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db')
+
+channel_cache = ChannelCache()
+
+async def run(func, *args, **kwargs):
+    """Run a synchronous db function on the database thread and await its result."""
+    loop = asyncio.get_running_loop()
+    # Timed from here, so the time spent queued behind other calls counts too
+    start = time.perf_counter()
+    try:
+        return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+    except Exception:
+        metrics.DB_ERRORS.inc(func.__name__)
+        raise
+    finally:
+        metrics.DB_SECONDS.observe(time.perf_counter() - start, func.__name__)
+
+def shutdown():
+    """Wait for queued database work to finish and close the connection."""
+    _executor.submit(db.close_db).result()
+    _executor.shutdown(wait=True)
+
+def updated_at() -> str:
+    """The current time as SQLite's CURRENT_TIMESTAMP would write it."""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())
+
+# Create
+async def create_plan(channel_id: int, plan_type: str, current_day: int = 0, paused: bool = False,
+                      guild_id: Optional[int] = None) -> Optional[int]:
+    """Create a new plan entry and return its ID, or None if the channel already has that plan."""
+    plan_id = await run(db.create_plan, channel_id, plan_type, current_day, paused, guild_id)
+    if plan_id is not None:
+        plan = await run(db.get_plan, plan_id)
+        if plan is not None:
+            channel_cache.add(plan)
+    return plan_id
+
+# Read
+async def get_plan(plan_id: int) -> Optional[dict]:
+    """Get a plan by its ID."""
+    plan = channel_cache.find(plan_id)
+    if plan is None:
+        plan = await run(db.get_plan, plan_id)
+    return plan
+
+async def get_plan_by_channel_and_type(channel_id: int, plan_type: str) -> Optional[dict]:
+    """Get plan for a specific channel and plan type."""
+    return next((p for p in await get_plans_by_channel(channel_id) if p['plan_type'] == plan_type), None)
+
+async def get_plans_by_channel(channel_id: int) -> List[dict]:
+    """Get all plans for a specific channel."""
+    plans = channel_cache.get(channel_id)
+    if plans is None:
+        version = channel_cache.version
+        plans = await run(db.get_plans_by_channel, channel_id)
+        channel_cache.put(channel_id, plans, version)
+    return plans
+
+async def get_all_plans() -> List[dict]:
+    """Get all plans."""
+    return await run(db.get_all_plans)
+
+async def get_publish_plans(shard: Optional[Tuple[int, List[int]]] = None) -> List[dict]:
+    """Get the plans the default publish run covers: those without their own publish time."""
+    return await run(db.get_publish_plans, shard)
+
+async def get_outbox(channel_ids: List[int]) -> Dict[int, Tuple[str, str]]:
+    """Get the pre-rendered (state, messages) of each of some channels that has them."""
+    return await run(db.get_outbox, channel_ids)
+
+async def get_unassigned_channels() -> List[int]:
+    """Get the channels of plans whose guild hasn't been recorded yet."""
+    return await run(db.get_unassigned_channels)
+
+# Update
+async def update_plan(plan_id: int, channel_id: int = None, plan_type: str = None,
+                      current_day: int = None, paused: bool = None) -> bool:
+    """Update a plan's details. Only updates provided fields."""
+    updated = await run(db.update_plan, plan_id, channel_id=channel_id, plan_type=plan_type,
+                        current_day=current_day, paused=paused)
+    fields = {'channel_id': channel_id, 'plan_type': plan_type, 'current_day': current_day,
+              'paused': None if paused is None else int(paused)}
+    channel_cache.update(plan_id, updated_at=updated_at(), **{k: v for k, v in fields.items() if v is not None})
+    return updated
+
+def forget_advanced(plan_ids: Optional[List[int]]):
+    """Drop the cached channels of plans a publish may have advanced: every channel unless plan_ids is given."""
+    if plan_ids is None:
+        channel_cache.clear()
+    else:
+        channel_cache.drop_plans(plan_ids)
+
+async def enqueue_plans(plan_lengths: Dict[str, int], publish_date: str, plan_ids: Optional[List[int]] = None,
+                        shard: Optional[Tuple[int, List[int]]] = None) -> int:
+    """Advance plans not yet journaled for publish_date and queue a delivery for each."""
+    queued = await run(db.enqueue_plans, plan_lengths, publish_date, plan_ids, shard)
+    forget_advanced(plan_ids)
+    return queued
+
+async def advance_plans(plan_lengths: Dict[str, int], publish_date: str, plan_ids: Optional[List[int]] = None,
+                        shard: Optional[Tuple[int, List[int]]] = None) -> List[dict]:
+    """Advance plans not yet journaled for publish_date and return its pending deliveries."""
+    deliveries = await run(db.advance_plans, plan_lengths, publish_date, plan_ids, shard)
+    forget_advanced(plan_ids)
+    return deliveries
+
+async def claim_deliveries(worker: str, publish_date: str, channels: int, lease_seconds: float) -> List[dict]:
+    """Lease the pending deliveries of a publish date for up to `channels` channels to a worker and return them."""
+    return await run(db.claim_deliveries, worker, publish_date, channels, lease_seconds)
+
+async def renew_leases(worker: str, lease_seconds: float) -> int:
+    """Extend a worker's leases on its unfinished deliveries."""
+    return await run(db.renew_leases, worker, lease_seconds)
+
+async def release_deliveries(worker: str) -> int:
+    """Give up a worker's leases on its unfinished deliveries so they can be claimed again."""
+    return await run(db.release_deliveries, worker)
+
+async def count_pending_deliveries(publish_date: str) -> int:
+    """Count a publish date's unfinished deliveries that workers haven't given up on, leased or not."""
+    return await run(db.count_pending_deliveries, publish_date)
+
+async def mark_delivery_sent(plan_id: int, publish_date: str, sent: int, completed: bool = False):
+    """Record how many of a delivery's messages have been sent, and whether that was all of them."""
+    return await run(db.mark_delivery_sent, plan_id, publish_date, sent, completed)
+
+async def prune_deliveries(days: int = 30) -> int:
+    """Delete deliveries journaled more than `days` days ago."""
+    return await run(db.prune_deliveries, days)
+
+async def get_timed_plans(shard: Optional[Tuple[int, List[int]]] = None) -> List[dict]:
+    """Get all plans that have their own publish time, optionally only those on some shards."""
+    return await run(db.get_timed_plans, shard)
+
+async def set_publish_time(plan_id: int, publish_time: Optional[str], timezone: Optional[str] = None) -> bool:
+    """Set a plan's daily publish time (HH:MM) and timezone, or clear it with None."""
+    updated = await run(db.set_publish_time, plan_id, publish_time, timezone)
+    channel_cache.update(plan_id, publish_time=publish_time, timezone=timezone if publish_time else None,
+                         updated_at=updated_at())
+    return updated
+
+async def save_outbox(rows: List[Tuple[int, str, str]]) -> int:
+    """Store pre-rendered (channel_id, state, messages) rows, dropping those of channels without plans."""
+    return await run(db.save_outbox, rows)
+
+async def set_channel_guilds(guilds: Dict[int, int]) -> int:
+    """Record the guild (0 for none) of each channel's plans."""
+    updated = await run(db.set_channel_guilds, guilds)
+    channel_cache.clear()
+    return updated
+
+async def normalize_plan_days(plan_type: str, plan_length: int) -> int:
+    """Wrap every plan of a type that is past the end of its plan back to day 0."""
+    wrapped = await run(db.normalize_plan_days, plan_type, plan_length)
+    channel_cache.clear()
+    return wrapped
+
+async def get_last_run(name: str) -> Optional[datetime]:
+    """Get when a named schedule last ran, if it ever has."""
+    return await run(db.get_last_run, name)
+
+async def set_last_run(name: str, last_run: datetime):
+    """Record when a named schedule last ran."""
+    return await run(db.set_last_run, name, last_run)
+
+# Delete
+async def delete_plan(plan_id: int) -> bool:
+    """Delete a plan by its ID. Returns True if successful."""
+    deleted = await run(db.delete_plan, plan_id)
+    channel_cache.remove(plan_id)
+    return deleted
@@ -0,0 +1,112 @@
+"""Online backups of the database with SQLite's backup API.
+
+A backup copies the database a few pages per step from its own connection,
+sleeping between steps, so it neither holds the shared connection that
+commands use nor blocks writers for long. The copy is read from a single
+snapshot held open until it finishes. WAL mode lets writers carry on
+meanwhile, so the copy is consistent and never restarts however busy the
+bot is.
+"""
+import os
+import sqlite3
+from datetime import datetime
+from typing import List
+import db
+
+BACKUP_DIR = 'backups'
+# Pages copied per step (4 KiB each by default) and the pause between steps
+BACKUP_PAGES = 256
+BACKUP_SLEEP = 0.005
+
+def backup_prefix() -> str:
+    """The start of every backup's file name: the database's, e.g. data-."""
+    return os.path.splitext(os.path.basename(db.DB_PATH))[0] + '-'
+
+def backup_name(when: datetime = None) -> str:
+    """File name of a backup taken at a moment, e.g. data-20240101-030000-000000.sqlite3.
+
+    Down to the microsecond, so backups taken in the same second don't share a name.
+    """
+    return f'{backup_prefix()}{(when or datetime.now()).strftime("%Y%m%d-%H%M%S-%f")}.sqlite3'
+
+def list_backups(directory: str = BACKUP_DIR) -> List[str]:
+    """Paths of the backups in a directory, oldest first."""
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory))
+            if name.startswith(backup_prefix()) and name.endswith('.sqlite3')]
+
+def check(path: str):
+    """Raise sqlite3.DatabaseError unless a database file passes a quick integrity check."""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        result = conn.execute('PRAGMA quick_check').fetchone()[0]
+    finally:
+        conn.close()
+    if result != 'ok':
+        raise sqlite3.DatabaseError(f'{path} is damaged: {result}')
+
+def backup(path: str, pages: int = BACKUP_PAGES, sleep: float = BACKUP_SLEEP) -> int:
+    """Copy the live database to `path` and return its size in bytes.
+
+    The copy is written next to `path` and only renamed into place once it
+    is complete and checked, so `path` never holds a partial backup.
+    """
+    partial = f'{path}.partial'
+    source = sqlite3.connect(db.DB_PATH, timeout=30)
+    target = sqlite3.connect(partial)
+    try:
+        # Pin one snapshot for every step. Without it, each step would read
+        # the latest state and any write would restart the copy
+        source.execute('BEGIN')
+        source.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        source.backup(target, pages=pages, sleep=sleep)
+        source.rollback()
+        # The copy inherits WAL mode; make it a single self-contained file
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+
+    try:
+        check(partial)
+    except sqlite3.DatabaseError:
+        os.remove(partial)
+        raise
+    os.replace(partial, path)
+    return os.path.getsize(path)
+
+def rotate(directory: str = BACKUP_DIR, keep: int = 7) -> List[str]:
+    """Delete all but the newest `keep` backups (all kept if 0) in a directory and return the deleted paths."""
+    backups = list_backups(directory)
+    expired = backups[:-keep] if keep > 0 else []
+    for path in expired:
+        os.remove(path)
+    return expired
+
+def backup_and_rotate(directory: str = BACKUP_DIR, keep: int = 7) -> str:
+    """Take a timestamped backup into a directory, then rotate it; returns the new backup's path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, backup_name())
+    while os.path.exists(path):
+        path = os.path.join(directory, backup_name())
+    backup(path)
+    rotate(directory, keep)
+    return path
+
+def restore(path: str):
+    """Replace the live database's contents with a backup's.
+
+    Only run this while the bot is stopped: a running bot keeps serving its
+    cached plans and would write over the restored state.
+    """
+    check(path)
+    source = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    target = sqlite3.connect(db.DB_PATH, timeout=30)
+    try:
+        source.backup(target)
+        # Backups are kept in rollback journal mode; the live database runs in WAL
+        target.execute('PRAGMA journal_mode = WAL')
+    finally:
+        target.close()
+        source.close()
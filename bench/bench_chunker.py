@@ -0,0 +1,56 @@
+"""Micro-benchmark of the streaming chunker against the original word-list chunker.
+
+Run from the repository root:
+
+    python bench/bench_chunker.py [--repeat N]
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunker import iter_chunks
+
+def legacy_chunks(reading: str, limit: int = 2000):
+    """The chunker send_daily_reading used before chunker.py, kept for comparison"""
+    chunks = []
+    current_chunk = []
+    current_length = 0
+    for word in reading.split():
+        word_length = len(word) + 1
+        if current_length + word_length > limit and current_chunk:
+            chunks.append(' '.join(current_chunk))
+            current_chunk = []
+            current_length = 0
+        current_chunk.append(word)
+        current_length += word_length
+    if current_chunk:
+        chunks.append(' '.join(current_chunk))
+    return chunks
+
+def legacy_day(readings):
+    return [chunk for reading in readings for chunk in legacy_chunks(reading)]
+
+def streaming_day(readings):
+    return list(iter_chunks(readings))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--plan', default='plans/mere_christianity.json')
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with open(args.plan, 'r') as f:
+        days = json.load(f)['readings']
+    characters = sum(len(r) for day in days for r in day)
+
+    for name, chunk_day in (('legacy', legacy_day), ('streaming', streaming_day)):
+        messages = sum(len(chunk_day(day)) for day in days)
+        best = min(timeit.repeat(lambda: [chunk_day(day) for day in days], number=1, repeat=args.repeat))
+        print(f'{name:>10}: {best * 1000:7.2f} ms for {len(days)} days '
+              f'({characters / best / 1e6:6.1f} Mchar/s), {messages} messages')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""A local stand-in for Discord's HTTP API, for offline benchmarks.
+
+FakeTransport models a per-request round trip with configurable latency and
+jitter, and answers a configurable fraction of requests with a 429 carrying
+retry_after, the way discord.py surfaces rate limits. FakeChannel and
+FakeContext expose the small part of discord.py's channel and command
+context interface the bot uses (send, message.channel, channel, guild).
+"""
+import asyncio
+import random
+import time
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+import metrics
+
+class FakeRateLimited(Exception):
+    """A 429 response, shaped like discord.HTTPException/RateLimited."""
+
+    status = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__(f'429 Too Many Requests (retry after {retry_after:.2f}s)')
+        self.retry_after = retry_after
+
+class FakeTransport:
+    """Simulated Discord HTTP API that records every request it serves."""
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0, rate_limit_rate: float = 0.0,
+                 retry_after: float = 0.25, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.channels: Dict[int, FakeChannel] = {}
+        self.requests = 0
+        self.rate_limited = 0
+        # Wall time of every request, including rejected ones
+        self.latencies: List[float] = []
+
+    def reset(self):
+        """Forget recorded requests."""
+        self.requests = 0
+        self.rate_limited = 0
+        self.latencies = []
+        for channel in self.channels.values():
+            channel.messages.clear()
+
+    def get_channel(self, channel_id: int) -> 'FakeChannel':
+        """Get a channel by ID, creating it on first use (like bot.get_channel for known channels)."""
+        channel = self.channels.get(channel_id)
+        if channel is None:
+            channel = self.channels[channel_id] = FakeChannel(self, channel_id)
+        return channel
+
+    async def request(self, channel: 'FakeChannel', payload: dict):
+        """Serve one message send."""
+        start = time.perf_counter()
+        self.requests += 1
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        try:
+            if self.rate_limit_rate and self.random.random() < self.rate_limit_rate:
+                self.rate_limited += 1
+                # As the bot's HTTP trace would for a real 429
+                metrics.record_rate_limit(self.retry_after, False)
+                raise FakeRateLimited(self.retry_after)
+            channel.messages.append(payload)
+        finally:
+            self.latencies.append(time.perf_counter() - start)
+
+class FakeChannel:
+    """A text channel whose sends go through a FakeTransport."""
+
+    def __init__(self, transport: FakeTransport, channel_id: int):
+        self.transport = transport
+        self.id = channel_id
+        self.messages: List[dict] = []
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        await self.transport.request(self, {'content': content, **kwargs})
+
+class FakeContext:
+    """Just enough of commands.Context to call the bot's command callbacks."""
+
+    def __init__(self, channel: FakeChannel):
+        self.channel = channel
+        self.guild = None
+        self.message = SimpleNamespace(channel=channel, guild=None)
+        self.prefix = '!'
+
+    async def defer(self, **kwargs):
+        pass
+
+    async def send(self, content: Optional[str] = None, **kwargs):
+        await self.channel.send(content, **kwargs)
@@ -0,0 +1,269 @@
+"""Offline benchmark suite for the bot.
+
+Runs against a scratch SQLite database and the fake Discord transport in
+fake_discord.py, so no token or network is needed. Every benchmark reports
+throughput and p50/p99 latency. Run from the repository root:
+
+    python bench/run.py                          # everything
+    python bench/run.py --only db,chunker        # a subset
+    python bench/run.py --sizes 10,1000 --latency 0.02 --rate-limit-rate 0.01
+    python bench/run.py --json results.json      # also save results for comparison
+
+The publish and command benchmarks import bot.py and so need discord.py
+installed; they are skipped with a note if it isn't.
+"""
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Callable, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+# db.py opens its database at import, so point it at a scratch file first
+SCRATCH_DIR = tempfile.mkdtemp(prefix='mbrpgabot-bench-')
+os.environ['DB_PATH'] = os.path.join(SCRATCH_DIR, 'data.sqlite3')
+os.chdir(REPO_ROOT)
+
+def remove_scratch():
+    """Delete the scratch database, which runs to hundreds of MB at the larger sizes."""
+    db.close_db()
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+atexit.register(remove_scratch)
+
+import db
+import metrics
+import publisher
+import registry
+from bench_chunker import legacy_day, streaming_day
+from fake_discord import FakeContext, FakeTransport
+
+SECTIONS = ('db', 'chunker', 'publish', 'commands')
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a list of values."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))]
+
+class Results:
+    """Collects and prints one row per benchmark."""
+
+    def __init__(self):
+        self.rows: List[Dict] = []
+        print(f'{"benchmark":<40} {"ops":>8} {"ops/s":>12} {"p50 ms":>10} {"p99 ms":>10}')
+
+    def add(self, name: str, latencies: List[float], wall: float = None, ops: int = None, **extra):
+        ops = len(latencies) if ops is None else ops
+        wall = sum(latencies) if wall is None else wall
+        row = {
+            'name': name,
+            'ops': ops,
+            'throughput': ops / wall if wall else 0.0,
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            **extra,
+        }
+        self.rows.append(row)
+        notes = ' '.join(f'{k}={v}' for k, v in extra.items())
+        print(f'{name:<40} {ops:>8} {row["throughput"]:>12.1f} {row["p50_ms"]:>10.3f} {row["p99_ms"]:>10.3f}  {notes}')
+
+def timed(func: Callable, iterations: int) -> List[float]:
+    """Call func(i) for each iteration, returning each call's wall time."""
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        func(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+async def timed_async(func: Callable, iterations: int) -> List[float]:
+    """Await func(i) for each iteration, returning each call's wall time."""
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await func(i)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def reset_db():
+    """Empty every table in the scratch database."""
+    with db.transaction() as conn:
+        conn.execute('DELETE FROM plans')
+        conn.execute('DELETE FROM deliveries')
+        conn.execute('DELETE FROM scheduler_runs')
+        conn.execute('DELETE FROM outbox')
+
+def seed_plans(count: int, first_channel: int = 1) -> List[int]:
+    """Insert `count` plans, one per channel, alternating plan types. Returns channel IDs."""
+    plan_types = sorted(registry.PLANS)
+    channel_ids = list(range(first_channel, first_channel + count))
+    with db.transaction() as conn:
+        conn.executemany(
+            'INSERT INTO plans (channel_id, plan_type, current_day) VALUES (?, ?, ?)',
+            [(c, plan_types[c % len(plan_types)], c % 100) for c in channel_ids]
+        )
+    return channel_ids
+
+def bench_db(results: Results, iterations: int):
+    """Every db.py function against a table of `iterations` plans."""
+    reset_db()
+    plan_lengths = {t: p.length for t, p in registry.PLANS.items()}
+    channels = seed_plans(iterations, first_channel=1_000_000)
+    ids = [p['id'] for p in db.get_all_plans()]
+
+    results.add('db.init_db (no pending migrations)', timed(lambda i: db.init_db(), 20))
+    results.add('db.create_plan', timed(lambda i: db.create_plan(i, 'mcheyne'), iterations))
+    results.add('db.get_plan', timed(lambda i: db.get_plan(ids[i]), iterations))
+    results.add('db.get_plan_by_channel_and_type',
+                timed(lambda i: db.get_plan_by_channel_and_type(channels[i], 'mcheyne'), iterations))
+    results.add('db.get_plans_by_channel', timed(lambda i: db.get_plans_by_channel(channels[i]), iterations))
+    results.add('db.get_all_plans', timed(lambda i: db.get_all_plans(), 10), plans=2 * iterations)
+    results.add('db.get_publish_plans', timed(lambda i: db.get_publish_plans(), 10), plans=2 * iterations)
+    results.add('db.export_plans', timed(lambda i: list(db.export_plans()), 5), plans=2 * iterations)
+    exported = list(db.export_plans())
+    results.add('db.import_plans (replace)', timed(lambda i: db.import_plans(exported, replace=True), 5),
+                plans=2 * iterations)
+    results.add('db.get_unassigned_channels', timed(lambda i: db.get_unassigned_channels(), 10),
+                channels=2 * iterations)
+    results.add('db.set_channel_guilds', timed(lambda i: db.set_channel_guilds({channels[i]: 0}), iterations))
+    results.add('db.update_plan', timed(lambda i: db.update_plan(ids[i], current_day=i % 100), iterations))
+    results.add('db.set_publish_time', timed(lambda i: db.set_publish_time(ids[i], None), iterations))
+    results.add('db.get_timed_plans', timed(lambda i: db.get_timed_plans(), 10))
+    results.add('db.advance_plans', timed(lambda i: db.advance_plans(plan_lengths, f'bench-db-{i}'), 5),
+                plans=2 * iterations)
+    results.add('db.mark_delivery_sent',
+                timed(lambda i: db.mark_delivery_sent(ids[i], 'bench-db-0', 1, completed=True), iterations))
+    results.add('db.enqueue_plans', timed(lambda i: db.enqueue_plans(plan_lengths, f'bench-queue-{i}'), 5),
+                plans=2 * iterations)
+    # Enough claims of 100 channels each to empty the first queued date
+    claims = -(-2 * iterations // 100)
+    results.add('db.claim_deliveries (100 channels)',
+                timed(lambda i: db.claim_deliveries('bench', 'bench-queue-0', 100, 60), claims))
+    results.add('db.renew_leases', timed(lambda i: db.renew_leases('bench', 60), 10), deliveries=2 * iterations)
+    results.add('db.count_pending_deliveries', timed(lambda i: db.count_pending_deliveries('bench-queue-1'), 10))
+    results.add('db.release_deliveries', timed(lambda i: db.release_deliveries('bench'), 10))
+    outbox = [(c, '[]', '[[], [], []]') for c in channels]
+    results.add('db.save_outbox', timed(lambda i: db.save_outbox(outbox), 5), channels=iterations)
+    results.add('db.get_outbox', timed(lambda i: db.get_outbox(channels), 10), channels=iterations)
+    results.add('db.prune_deliveries', timed(lambda i: db.prune_deliveries(), 10))
+    results.add('db.normalize_plan_days', timed(lambda i: db.normalize_plan_days('mcheyne', 700), 10))
+    results.add('db.set_last_run', timed(lambda i: db.set_last_run('bench', datetime.now().astimezone()), iterations))
+    results.add('db.get_last_run', timed(lambda i: db.get_last_run('bench'), iterations))
+    results.add('db.delete_plan', timed(lambda i: db.delete_plan(ids[i]), iterations))
+
+def bench_chunker(results: Results):
+    """Both chunkers over every day of the book plan."""
+    with open(os.path.join(registry.PLANS_DIR, 'mere_christianity.json'), 'r') as f:
+        days = json.load(f)['readings']
+    characters = sum(len(r) for day in days for r in day)
+    for name, chunk_day in (('legacy', legacy_day), ('streaming', streaming_day)):
+        latencies = timed(lambda i: chunk_day(days[i % len(days)]), len(days) * 5)
+        results.add(f'chunker.{name} (per day)', latencies, chars_per_day=characters // len(days))
+
+def import_bot():
+    """Import bot.py, or explain why the bot benchmarks can't run."""
+    try:
+        import bot
+    except ImportError as e:
+        print(f'  skipped: bot.py could not be imported ({e}); install requirements.txt to run it')
+        return None
+    return bot
+
+async def bench_publish(results: Results, bot, transport: FakeTransport, sizes: List[int], concurrency: int):
+    """bot.publish_readings over fleets of each size."""
+    bot.bot.get_channel = transport.get_channel
+    bot.args.concurrency = concurrency
+    for size in sizes:
+        reset_db()
+        seed_plans(size)
+        transport.reset()
+
+        # Warm the outbox as the previous publish would have, timed on its own
+        start = time.perf_counter()
+        await bot.prerender_outbox()
+        wall = time.perf_counter() - start
+        results.add(f'prerender {size} plans', [wall], ops=size, wall_s=round(wall, 2))
+
+        hits = metrics.OUTBOX_CHANNELS.series.get(('hit',), 0)
+        start = time.perf_counter()
+        await bot.publish_readings(f'bench-publish-{size}', prerender=False)
+        wall = time.perf_counter() - start
+
+        results.add(f'publish {size} plans (per message)', transport.latencies, wall=wall,
+                    plans_per_s=round(size / wall, 1), requests=transport.requests,
+                    rate_limited=transport.rate_limited, wall_s=round(wall, 2),
+                    outbox_hits=int(metrics.OUTBOX_CHANNELS.series.get(('hit',), 0) - hits))
+
+async def bench_commands(results: Results, bot, transport: FakeTransport, iterations: int):
+    """Each command handler, called directly with fake contexts."""
+    reset_db()
+    transport.reset()
+    contexts = [FakeContext(transport.get_channel(2_000_000 + i)) for i in range(iterations)]
+    command = bot.bot.get_command
+
+    calls = (
+        ('start', lambda ctx: command('start').callback(ctx, 'mcheyne')),
+        ('plans', lambda ctx: command('plans').callback(ctx)),
+        ('readings', lambda ctx: command('readings').callback(ctx)),
+        ('set', lambda ctx: command('set').callback(ctx, 'mcheyne', 5)),
+        ('pause', lambda ctx: command('pause').callback(ctx, 'mcheyne')),
+        ('resume', lambda ctx: command('resume').callback(ctx, 'mcheyne')),
+        ('time', lambda ctx: command('time').callback(ctx, 'mcheyne', '06:00', 'UTC')),
+        ('stop', lambda ctx: command('stop').callback(ctx, 'mcheyne')),
+    )
+    for name, call in calls:
+        latencies = await timed_async(lambda i: call(contexts[i]), iterations)
+        results.add(f'command !{name}', latencies)
+
+async def main():
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the bot')
+    parser.add_argument('--only', default=','.join(SECTIONS), help=f'Comma-separated sections: {", ".join(SECTIONS)}')
+    parser.add_argument('--sizes', default='10,1000,50000', help='Plan counts for the publish benchmark')
+    parser.add_argument('--iterations', type=int, default=1000, help='Calls per db/command benchmark')
+    parser.add_argument('--latency', type=float, default=0.02, help='Simulated Discord round trip in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='Extra random latency of up to this many seconds')
+    parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Fraction of sends answered with a 429')
+    parser.add_argument('--retry-after', type=float, default=0.25, help='retry_after on simulated 429s')
+    parser.add_argument('--concurrency', type=int, default=100, help='Publisher concurrency')
+    parser.add_argument('--discord-limits', action='store_true',
+                        help="Pace sends at Discord's real rate limits instead of unthrottled")
+    parser.add_argument('--json', help='Also write the results to this file')
+    args = parser.parse_args()
+
+    sections = args.only.split(',')
+    if not args.discord_limits:
+        # Measure the bot's own overhead; the fake transport has no real limits
+        publisher.GLOBAL_RATE = publisher.CHANNEL_RATE = (10 ** 9, 1.0)
+    transport = FakeTransport(latency=args.latency, jitter=args.jitter, rate_limit_rate=args.rate_limit_rate,
+                              retry_after=args.retry_after)
+
+    print(f'scratch database: {db.DB_PATH}')
+    results = Results()
+    if 'db' in sections:
+        bench_db(results, args.iterations)
+    if 'chunker' in sections:
+        bench_chunker(results)
+    if 'publish' in sections or 'commands' in sections:
+        bot = import_bot()
+        if bot is not None and 'publish' in sections:
+            await bench_publish(results, bot, transport, [int(s) for s in args.sizes.split(',')], args.concurrency)
+        if bot is not None and 'commands' in sections:
+            await bench_commands(results, bot, transport, min(args.iterations, 200))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results.rows, f, indent=2)
+
+if __name__ == '__main__':
+    asyncio.run(main())
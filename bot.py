@@ -1,88 +1,595 @@
+import aiohttp
+import asyncio
+import cProfile
 import discord
+import functools
 import json
+import logging
 import os
-import db
-from discord.ext import commands
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import metrics
+import profiling
+# Importing these migrates the database and loads the plans
+with profiling.stage('startup: db init'):
+    import adb
+with profiling.stage('startup: load plans'):
+    import registry
+import backup
+import render
+from discord import app_commands
+from discord.ext import commands, tasks
+import publisher
+from publisher import Publisher, PublishSummary
+from chunker import iter_chunks
+from plan_store import MESSAGE_LIMIT
+from registry import PLAN_HASHES, PLANS
+from scheduler import DailyScheduler, PlanTimers, parse_time, parse_times
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from render import format_plan_name, pack_payloads, render_daily_reading, render_help_plans, render_plan_list
 import argparse
 
+logger = logging.getLogger(__name__)
+
 # Set up the CLI
 parser = argparse.ArgumentParser()
 parser.add_argument('-p', '--publish', action='store_true', help='Publish reading plans to registered channels')
-args = parser.parse_args()
-
-# Parse the .env for env vars
-with open('.env', 'r') as f:
-    for line in f:
-        line = line.strip()
-        if line and not line.startswith('#'):
-            key, value = line.split('=', 1)
-            os.environ[key.strip()] = value.strip()
-
-# Load the plans
-PLANS = {os.path.splitext(p)[0]: json.load(open(f"plans/{p}", 'r')) for p in os.listdir('plans') if p.endswith('.json')}
-
-# Prepare the bot
-intents = discord.Intents.default()
-intents.typing = False
-intents.presences = False
-intents.message_content = True
-bot = commands.Bot(intents=intents, command_prefix='!')
+parser.add_argument('--publish-date', help='Journal key for --publish and --worker (default today); rerunning a date resumes it')
+parser.add_argument('-c', '--concurrency', type=int, default=10, help='Number of channels to publish to at once')
+parser.add_argument('--embeds', action='store_true', help='Send book readings as embeds (fewer messages) instead of plain text chunks')
+parser.add_argument('-s', '--schedule', help='Publish daily at these local times (e.g. 06:00 or 06:00,18:00) while running')
+parser.add_argument('--catch-up', type=int, default=1, help='Missed scheduled publishes to run on startup after downtime')
+parser.add_argument('--jitter', type=float, default=60, help='Spread plans sharing a publish time over this many seconds')
+parser.add_argument('--reload-interval', type=float, default=30, help='Seconds between checks of plans/ for edits (0 disables)')
+parser.add_argument('--shard-count', type=int, help="Total number of shards (default Discord's recommendation)")
+parser.add_argument('--shard-ids', help='Shards this process runs, e.g. 0-3 or 0,2 (default all; needs --shard-count)')
+parser.add_argument('--processes', type=int, default=1, help='Split the shards across this many bot processes (needs --shard-count)')
+parser.add_argument('-w', '--workers', type=int, default=0, help='Queue publishes for this many worker processes to send instead of sending in-process')
+parser.add_argument('--worker', action='store_true', help="Run as a publish worker: send the --publish-date's queued deliveries over HTTP until none are left")
+parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics at http://<metrics-host>:<port>/metrics')
+parser.add_argument('--metrics-host', default='127.0.0.1', help='Address to serve metrics on (default localhost only)')
+parser.add_argument('--profile', metavar='PATH', help='Write a cProfile dump to PATH and a stage timing breakdown to PATH.txt on exit ({pid} is replaced)')
+parser.add_argument('--prefix-commands', action='store_true', help='Also accept !commands in messages (needs the privileged message content intent)')
+parser.add_argument('--sync-commands', action='store_true', help="Register the slash commands with Discord on startup (after adding or changing commands)")
+parser.add_argument('--backup-schedule', help='Back up the database daily at these local times (e.g. 03:00) while running')
+parser.add_argument('--backup-dir', default=backup.BACKUP_DIR, help='Directory to keep database backups in')
+parser.add_argument('--backup-keep', type=int, default=7, help='Number of newest backups to keep (0 keeps all)')
+parser.add_argument('--rate-share', type=int, default=1, help="Bot processes sending at once, each kept to this share of Discord's global rate limit (set for --processes children)")
+parser.add_argument('--lease', type=float, default=60, help='Seconds a worker holds claimed deliveries before another may reclaim them')
+# Imported (e.g. by the benchmarks) rather than run, use the defaults
+args = parser.parse_args() if __name__ == '__main__' else parser.parse_args([])
+
+def parse_shard_ids(value: str) -> List[int]:
+    """Parse shard IDs given as a comma-separated list of IDs and ranges, e.g. '0-3,8'
+
+    Raises ValueError for a part that isn't an ID or a range of at least one ID.
+    """
+    shard_ids = []
+    for part in value.split(','):
+        first, dash, last = part.partition('-')
+        ids = range(int(first), int(last if dash else first) + 1)
+        if not ids:
+            raise ValueError(f'{part!r} is an empty range')
+        shard_ids.extend(ids)
+    return sorted(set(shard_ids))
+
+try:
+    shard_ids = parse_shard_ids(args.shard_ids) if args.shard_ids else None
+except ValueError as e:
+    # An empty list would run as if unsharded and publish every plan
+    parser.error(f'--shard-ids must be IDs or ranges such as 0-3,8: {e}')
+if (shard_ids or args.processes > 1) and not args.shard_count:
+    parser.error('--shard-ids and --processes need --shard-count')
+if shard_ids and not all(0 <= shard_id < args.shard_count for shard_id in shard_ids):
+    parser.error(f'--shard-ids must be between 0 and {args.shard_count - 1}')
+
+def load_env(path: str = '.env'):
+    """Parse the .env for env vars"""
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#'):
+                key, value = line.split('=', 1)
+                os.environ[key.strip()] = value.strip()
+
+class InstrumentedContext(commands.Context):
+    """Command context whose replies are timed for metrics"""
+
+    async def send(self, *args, **kwargs):
+        try:
+            with metrics.SEND_SECONDS.time('command'):
+                return await super().send(*args, **kwargs)
+        except Exception:
+            metrics.SEND_ERRORS.inc('command')
+            raise
+
+async def record_rate_limit(session, context, params: aiohttp.TraceRequestEndParams):
+    """Count every 429 Discord answers, including those discord.py retries without raising"""
+    if params.response.status == 429:
+        metrics.record_rate_limit(*publisher.parse_rate_limit(params.response.headers))
+
+def http_trace() -> aiohttp.TraceConfig:
+    """Hooks for discord.py's HTTP session, which recording 429s needs"""
+    trace = aiohttp.TraceConfig()
+    trace.on_request_end.append(record_rate_limit)
+    return trace
+
+class BibleReadingBot(commands.AutoShardedBot):
+    # Process and CPU time when login finished, until the gateway is ready
+    connect_started = None
+
+    async def get_context(self, origin, *, cls=InstrumentedContext):
+        return await super().get_context(origin, cls=cls)
+
+    async def login(self, token: str):
+        with profiling.stage('startup: login'):
+            await super().login(token)
+        self.connect_started = (time.perf_counter(), time.process_time())
+
+    async def setup_hook(self):
+        # Slash commands are global, so one process registering them is enough
+        if args.sync_commands and not args.publish and (not shard_ids or 0 in shard_ids):
+            synced = await self.tree.sync()
+            logger.info('Registered %d slash commands', len(synced))
+
+# Rate limit waits longer than this raise discord.RateLimited instead of
+# blocking the send, so the publisher can hold the channel and retry it.
+# 30 seconds is the least discord.py allows
+RATE_LIMIT_TIMEOUT = 30.0
+
+# Prepare the bot. Slash commands arrive as interactions, which need no
+# intents, and guilds keeps the channel cache publishing sends through.
+intents = discord.Intents.none()
+intents.guilds = True
+if args.prefix_commands:
+    # Every message the bot can see, to pick out the ones starting with !
+    intents.guild_messages = True
+    intents.dm_messages = True
+    intents.message_content = True
+    command_prefix = '!'
+else:
+    # No messages arrive, so any prefix will do. discord.py warns that the
+    # message content intent is missing on every start for all but this one
+    command_prefix = commands.when_mentioned
+# Runs every shard (or --shard-ids) over its own gateway connection in this process.
+# Nothing needs members or past messages, so neither is cached or requested,
+# and guild state stays roughly constant per guild.
+bot = BibleReadingBot(intents=intents, command_prefix=command_prefix, shard_count=args.shard_count, shard_ids=shard_ids,
+                      member_cache_flags=discord.MemberCacheFlags.none(), chunk_guilds_at_startup=False,
+                      max_messages=None, http_trace=http_trace(), max_ratelimit_timeout=RATE_LIMIT_TIMEOUT)
+
+# Name the publish run is recorded under for scheduled catch-up, per shard range
+PUBLISH_SCHEDULE = f'publish:shards-{args.shard_ids}' if shard_ids else 'publish'
+schedule_task = None
+
+# Channels a publish worker claims at a time
+WORKER_BATCH = 100
+
+# Plans with their own publish time, keyed by next fire time
+plan_timers = PlanTimers(jitter=args.jitter)
+plan_timers_task = None
+metrics_server = None
+prerender_task = None
+backup_task = None
+
+def global_rate() -> Tuple[int, float]:
+    """This process's share of Discord's global rate limit, which is per bot, not per process
+
+    Shard processes are told how many of them there are with --rate-share,
+    and each one's --workers N publish workers split its share N ways.
+    """
+    senders = args.rate_share * (args.workers if args.worker and args.workers else 1)
+    # Looked up on the module so the benchmarks can lift the limit
+    rate, per = publisher.GLOBAL_RATE
+    return max(rate // senders, 1), per
+
+def owned_shards() -> Optional[Tuple[int, List[int]]]:
+    """(shard_count, shard_ids) if this process runs only some of the shards, else None"""
+    return (args.shard_count, shard_ids) if shard_ids else None
+
+async def assign_plan_guilds():
+    """Record the guild of plans created before guild IDs were stored, so shards can tell who owns them
+
+    Only a process running some of the shards needs them. Channels in its
+    guilds are found in the cache. The process running shard 0 (which owns
+    DMs) looks the rest up over HTTP.
+    """
+    if owned_shards() is None:
+        return
+
+    guilds = {}
+    fetch = 0 in shard_ids
+    for channel_id in await adb.get_unassigned_channels():
+        channel = bot.get_channel(channel_id)
+        if channel is None and fetch:
+            try:
+                channel = await bot.fetch_channel(channel_id)
+            except (discord.NotFound, discord.Forbidden):
+                # Nothing can be sent there either, so shard 0 may as well own it
+                # rather than looking it up again on every start
+                guilds[channel_id] = 0
+                continue
+            except discord.HTTPException as e:
+                logger.warning('Could not look up the guild of channel %s: %s', channel_id, e)
+                continue
+        if channel is not None:
+            guild = getattr(channel, 'guild', None)
+            guilds[channel_id] = guild.id if guild else 0
+
+    if guilds:
+        updated = await adb.set_channel_guilds(guilds)
+        logger.info('Recorded the guild of %d plans', updated)
+
+async def publish_readings(publish_date: str, plan_ids: List[int] = None, prerender: bool = True):
+    """Advance plans and send each channel its daily readings for a publish date
+
+    Publishes every plan without its own publish time, or only plan_ids, of
+    the shards this process runs. Each plan is advanced and each message
+    recorded in the delivery journal, so rerunning an interrupted publish date
+    only sends what is left. With --workers, plans are queued and worker
+    processes send them instead. A default publish then pre-renders the next
+    one unless `prerender` is False.
+    """
+    # Advance every unpaused plan (wrapping to day 1 at the end) in one transaction
+    plan_lengths = {plan_type: get_plan_length(plan_type) for plan_type in PLANS}
+    if args.workers and plan_ids is None:
+        # Timed plans come due a few at a time and aren't worth starting workers for
+        with profiling.stage('publish: advance plans'):
+            queued = await adb.enqueue_plans(plan_lengths, publish_date, plan_ids, owned_shards())
+        logger.info('Queued %d deliveries for %s', queued, publish_date)
+        with profiling.stage('publish: workers'):
+            await run_publish_workers(publish_date)
+    else:
+        with profiling.stage('publish: advance plans'):
+            deliveries = await adb.advance_plans(plan_lengths, publish_date, plan_ids, owned_shards())
+        outbox = {}
+        if plan_ids is None:
+            with profiling.stage('publish: read outbox'):
+                outbox = await adb.get_outbox(list({d['channel_id'] for d in deliveries}))
+        summary = PublishSummary()
+        jobs = await build_jobs(deliveries, bot.get_channel, outbox, summary)
+        with profiling.stage('publish: send'):
+            summary = await Publisher(concurrency=args.concurrency, send=send_payload, global_rate=global_rate()).publish(jobs, summary)
+        logger.info('Publish for %s finished: %s', publish_date, summary)
+
+    if plan_ids is None:
+        # Once a day is enough, and keeps timed publishes to their own plans
+        await adb.prune_deliveries()
+        # Lets a --schedule bot started later know today's run already happened
+        await adb.set_last_run(PUBLISH_SCHEDULE, datetime.now().astimezone())
+    if plan_ids is None and prerender:
+        # Get the next run's messages ready while nothing is waiting on them
+        await prerender_outbox()
+
+async def build_jobs(deliveries: List[dict], get_channel, outbox: Dict[int, Tuple[str, str]] = None,
+                     summary: PublishSummary = None) -> List[Tuple]:
+    """Turn deliveries into Publisher jobs sending each channel its remaining messages, journaling as they go
+
+    A channel's messages are taken from the outbox (see prerender_outbox) when
+    it holds a rendering of exactly these deliveries, and rendered otherwise.
+    A channel whose messages can't be rendered is left out and counted as
+    failed in `summary`, so it doesn't hold up the others.
+    """
+    by_channel = {}
+    for delivery in deliveries:
+        by_channel.setdefault(delivery['channel_id'], []).append(delivery)
+
+    jobs = []
+    for channel_id, channel_deliveries in by_channel.items():
+        channel_deliveries.sort(key=lambda d: d['plan_id'])
+        prerendered = (outbox or {}).get(channel_id)
+        if prerendered is not None and prerendered[0] == channel_state(channel_deliveries):
+            payloads, carried, finished = json.loads(prerendered[1])
+            metrics.OUTBOX_CHANNELS.inc('hit')
+        else:
+            try:
+                payloads, carried, finished = render_channel(channel_deliveries)
+            except Exception:
+                logger.exception('Failed to render the readings for channel %s', channel_id)
+                if summary is not None:
+                    summary.failed += 1
+                continue
+            metrics.OUTBOX_CHANNELS.inc('miss')
+
+        for index, total in finished:
+            await record_sent(channel_deliveries[index], total, 0)
+        if payloads:
+            progress = [[(channel_deliveries[index], total, count) for index, total, count in c] for c in carried]
+            jobs.append((get_channel(channel_id), payloads, functools.partial(record_packed, progress)))
+    return jobs
+
+def render_channel(deliveries: List[dict]) -> Tuple[List[dict], List[List[Tuple[int, int, int]]], List[Tuple[int, int]]]:
+    """Render one channel's remaining messages across all of its plans and pack them
+
+    Returns the packed payloads, the (delivery index, total messages, sent so
+    far) of each delivery each payload carries, and the (delivery index, total
+    messages) of deliveries with nothing left to send.
+    """
+    parts, finished = [], []
+    for index, delivery in enumerate(deliveries):
+        with profiling.stage(f'render: {delivery["plan_type"]}'):
+            payloads = render_daily_reading(delivery, embeds=args.embeds)
+        remaining = payloads[delivery['sent']:]
+        if remaining:
+            parts.append((index, len(payloads), remaining))
+        else:
+            finished.append((index, len(payloads)))
+
+    # Pack them into as few messages as possible
+    with profiling.stage('publish: pack'):
+        packed = pack_payloads([remaining for _, _, remaining in parts])
+    carried = [[(parts[part][0], parts[part][1], count) for part, count in c] for _, c in packed]
+    return [payload for payload, _ in packed], carried, finished
+
+def channel_state(deliveries: List[dict]) -> str:
+    """Everything a channel's rendered messages depend on, to tell whether its outbox entry is current"""
+    return json.dumps([args.embeds, [[d['plan_id'], d['plan_type'], PLAN_HASHES.get(d['plan_type']), d['current_day'],
+                                      bool(d['paused']), d['sent']] for d in deliveries]])
+
+async def prerender_outbox():
+    """Render every channel's messages for the next default publish ahead of time, into the outbox
+
+    Predicts the delivery the next publish will journal for each plan: its next
+    day (wrapping at the end), or its current day if paused. A channel whose
+    plans change before then no longer matches its outbox entry and is
+    rendered at publish time instead.
+    """
+    with profiling.stage('prerender'):
+        by_channel = {}
+        for plan in await adb.get_publish_plans(owned_shards()):
+            if plan['plan_type'] not in PLANS:
+                continue
+            day = plan['current_day']
+            if not plan['paused']:
+                day = 0 if day + 1 >= get_plan_length(plan['plan_type']) else day + 1
+            by_channel.setdefault(plan['channel_id'], []).append({
+                'plan_id': plan['id'], 'channel_id': plan['channel_id'], 'plan_type': plan['plan_type'],
+                'current_day': day, 'paused': plan['paused'], 'sent': 0,
+            })
+
+        rows = []
+        for n, (channel_id, deliveries) in enumerate(by_channel.items(), 1):
+            deliveries.sort(key=lambda d: d['plan_id'])
+            try:
+                rows.append((channel_id, channel_state(deliveries), json.dumps(render_channel(deliveries))))
+            except Exception:
+                # Left for the publish to render, which fails and reports it
+                logger.exception('Failed to pre-render the readings for channel %s', channel_id)
+            if n % 500 == 0:
+                # Let commands run in between
+                await asyncio.sleep(0)
+        saved = await adb.save_outbox(rows)
+    logger.info('Pre-rendered the next publish for %d channels', saved)
+
+async def run_publish_workers(publish_date: str):
+    """Start --workers worker processes and wait for them to drain a publish date's delivery queue"""
+    # Later arguments win, so the workers send the date just queued
+    workers = [
+        await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), *sys.argv[1:], '--worker',
+                                             '--publish-date', publish_date)
+        for _ in range(args.workers)
+    ]
+    for worker in workers:
+        if await worker.wait():
+            logger.warning('Publish worker %s exited with code %s', worker.pid, worker.returncode)
+
+async def run_worker():
+    """Claim batches of the --publish-date's queued deliveries and send them until none are left
+
+    Sends over HTTP only, without a gateway connection. Claims are leased for
+    --lease seconds and renewed while sending, so if this worker dies its
+    deliveries are picked up by another once the lease runs out.
+    """
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    publish_date = args.publish_date or date.today().isoformat()
+    client = discord.Client(intents=discord.Intents.none(), http_trace=http_trace(),
+                            max_ratelimit_timeout=RATE_LIMIT_TIMEOUT)
+    await client.login(os.environ['TOKEN'])
+    total = PublishSummary()
+    try:
+        while True:
+            deliveries = await adb.claim_deliveries(worker, publish_date, WORKER_BATCH, args.lease)
+            if not deliveries:
+                if not await adb.count_pending_deliveries(publish_date):
+                    break
+                # Others hold the rest; wait in case their leases run out
+                await asyncio.sleep(min(args.lease / 2, 5))
+                continue
+
+            heartbeat = asyncio.create_task(renew_leases(worker))
+            try:
+                outbox = await adb.get_outbox(list({d['channel_id'] for d in deliveries}))
+                summary = PublishSummary()
+                jobs = await build_jobs(deliveries, client.get_partial_messageable, outbox, summary)
+                with profiling.stage('publish: send'):
+                    summary = await Publisher(concurrency=args.concurrency, send=send_payload, global_rate=global_rate()).publish(jobs, summary)
+            finally:
+                heartbeat.cancel()
+                # Failed channels go back in the queue for another attempt
+                await adb.release_deliveries(worker)
+            total.add(summary)
+    finally:
+        await client.close()
+    logger.info('Worker %s finished: %s', worker, total)
+
+async def renew_leases(worker: str):
+    """Keep a worker's claimed deliveries leased while it is still sending them"""
+    while True:
+        await asyncio.sleep(args.lease / 3)
+        await adb.renew_leases(worker, args.lease)
+
+async def record_sent(delivery: dict, total: int, sent: int):
+    """Journal that another of a delivery's messages went out"""
+    sent += delivery['sent']
+    await adb.mark_delivery_sent(delivery['plan_id'], delivery['publish_date'], sent, completed=sent >= total)
+
+async def record_packed(progress: List[List[Tuple[dict, int, int]]], n: int):
+    """Journal every delivery carried by the nth packed message of a channel"""
+    for delivery, total, sent in progress[n - 1]:
+        await record_sent(delivery, total, sent)
+
+async def publish_due_plans(due: List[Tuple[int, str]]):
+    """Publish plans whose own publish time came due, grouped by their local date"""
+    by_date = {}
+    for plan_id, publish_date in due:
+        by_date.setdefault(publish_date, []).append(plan_id)
+    for publish_date, plan_ids in by_date.items():
+        await publish_readings(publish_date, plan_ids)
+
+async def run_plan_timers():
+    """Publish plans that have their own publish time as each one comes due"""
+    for plan in await adb.get_timed_plans(owned_shards()):
+        plan_timers.schedule(plan['id'], parse_time(plan['publish_time']), plan['timezone'])
+    await plan_timers.run_forever(publish_due_plans)
+
+def schedule_run_key(slot: datetime) -> str:
+    """Journal key for a scheduled run: its date, plus the time when publishing several times a day"""
+    if len(parse_times(args.schedule)) > 1:
+        return slot.strftime('%Y-%m-%dT%H:%M')
+    return slot.date().isoformat()
+
+async def run_publish_schedule():
+    """Publish at each --schedule time without restarting the bot"""
+    schedule = DailyScheduler(
+        parse_times(args.schedule),
+        lambda slot: publish_readings(schedule_run_key(slot)),
+        load_last_run=lambda: adb.get_last_run(PUBLISH_SCHEDULE),
+        save_last_run=lambda last_run: adb.set_last_run(PUBLISH_SCHEDULE, last_run),
+        max_catch_up=args.catch_up,
+    )
+    await schedule.run_forever()
+
+async def run_backup_schedule():
+    """Back up the database at each --backup-schedule time, keeping the newest --backup-keep"""
+    async def take_backup(slot: datetime):
+        # Off the database thread, so commands carry on during the copy
+        with profiling.stage('backup'):
+            path = await asyncio.to_thread(backup.backup_and_rotate, args.backup_dir, args.backup_keep)
+        logger.info('Backed up the database to %s', path)
+
+    schedule = DailyScheduler(
+        parse_times(args.backup_schedule),
+        take_backup,
+        load_last_run=lambda: adb.get_last_run('backup'),
+        save_last_run=lambda last_run: adb.set_last_run('backup', last_run),
+    )
+    await schedule.run_forever()
 
 # Optionally publish reading plans to registered channels
 @bot.event
 async def on_ready():
+    global schedule_task, plan_timers_task, metrics_server, prerender_task, backup_task
+    if bot.connect_started:
+        wall, cpu = bot.connect_started
+        profiling.STAGES.add('startup: gateway connect', time.perf_counter() - wall, time.process_time() - cpu)
+        bot.connect_started = None
+    await assign_plan_guilds()
     if args.publish and bot.is_ready():
-        registered_plans = db.get_all_plans()
-        for plan in registered_plans:
-            ctx = bot.get_channel(plan["channel_id"])
-
-            # Increment the day if the plan is not paused
-            if not plan["paused"]:
-                plan['current_day'] += 1
-                # Wrap to 0 if we've exceeded the plan length
-                plan['current_day'] = normalize_day(plan['current_day'], plan['plan_type'])
-                db.update_plan(plan["id"], current_day=plan["current_day"])
-
-            await send_daily_reading(ctx, plan)
-            
+        await publish_readings(args.publish_date or date.today().isoformat())
         await bot.close()
+        return
+
+    if args.schedule and schedule_task is None:
+        schedule_task = asyncio.create_task(run_publish_schedule())
+    if plan_timers_task is None:
+        plan_timers_task = asyncio.create_task(run_plan_timers())
+    if prerender_task is None:
+        prerender_task = asyncio.create_task(prerender_outbox())
+    # Shard processes share one database, so one of them backs it up
+    if args.backup_schedule and backup_task is None and (not shard_ids or 0 in shard_ids):
+        backup_task = asyncio.create_task(run_backup_schedule())
+    if args.reload_interval and not watch_plans.is_running():
+        watch_plans.change_interval(seconds=args.reload_interval)
+        watch_plans.start()
+    if args.metrics_port and metrics_server is None:
+        metrics_server = await metrics.serve(args.metrics_host, args.metrics_port)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.started_at = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_metrics(ctx):
+    """Time every command that completed; failures are recorded by record_command_error"""
+    if not ctx.command_failed:
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - ctx.started_at, ctx.command.qualified_name)
+
+# A listener rather than an override, so discord.py still logs the error.
+# Slash invocations skip the after-invoke hooks when the command raises, so
+# failures are only seen here
+@bot.listen('on_command_error')
+async def record_command_error(ctx, error):
+    """Count every command that raised, and time it if it got as far as running"""
+    if ctx.command is None:
+        return
+    name = ctx.command.qualified_name
+    metrics.COMMAND_ERRORS.inc(name)
+    started_at = getattr(ctx, 'started_at', None)
+    if started_at is not None:
+        metrics.COMMAND_SECONDS.observe(time.perf_counter() - started_at, name)
+
+@tasks.loop(seconds=30)
+async def watch_plans():
+    """Hot-reload edited plan files without restarting the bot"""
+    # An exception would end the loop for good, so log it and try again next time
+    try:
+        # Compile in a thread, but swap on the loop, which is what reads PLANS
+        plans = await asyncio.to_thread(registry.compile_changed_plans)
+        if not plans:
+            return
+
+        changed = registry.swap_plans(plans)
+        render.clear_cache()
+        for plan_type in changed:
+            # Running plans may now be past the end of a shortened plan
+            wrapped = await adb.normalize_plan_days(plan_type, get_plan_length(plan_type))
+            logger.info('Reloaded plan %s (%d running plans wrapped to day 1)', plan_type, wrapped)
+        # The outbox was rendered from the old versions
+        await prerender_outbox()
+    except Exception:
+        logger.exception('Reloading plans failed')
+
+def render_help(prefix: str) -> discord.Embed:
+    """The help embed, with commands shown as invoked with `prefix` (/ or !)"""
+    embed = discord.Embed(
+        title="Bible Reading Plan Bot Commands",
+        color=discord.Color.blurple()
+    )
+
+    commands_text = f"""
+• `{prefix}plans` - List all active reading plans in this channel
+• `{prefix}start <type>` - Start a new reading plan in the current channel
+• `{prefix}stop <type>` - Stop and remove a reading plan
+• `{prefix}readings` - Get the current readings for the channel
+• `{prefix}set <type> <day>` - Set the current day for a reading plan
+• `{prefix}pause <type>` - Pause the specified reading plan
+• `{prefix}resume <type>` - Resume a paused reading plan
+• `{prefix}time <type> <HH:MM> [timezone]` - Publish a plan daily at its own time (`off` to undo)
+"""
+    embed.add_field(name="Available Commands", value=commands_text, inline=False)
+
+    embed.add_field(name="Available Reading Plans", value=render_help_plans(), inline=False)
+    return embed
 
 class BibleReadingBotHelp(commands.MinimalHelpCommand):
     async def send_bot_help(self, mapping):
-        embed = discord.Embed(
-            title="Bible Reading Plan Bot Commands",
-            color=discord.Color.blurple()
-        )
-        
-        commands_text = """
-• `!plans` - List all active reading plans in this channel
-• `!start <type>` - Start a new reading plan in the current channel
-• `!stop <type>` - Stop and remove a reading plan
-• `!readings <type>` - Get the current reading plan for the channel
-• `!set <type> <day>` - Set the current day for a reading plan
-• `!pause <type>` - Pause the specified reading plan
-• `!resume <type>` - Resume a paused reading plan
-"""
-        embed.add_field(name="Available Commands", value=commands_text, inline=False)
-        
-        plans_text = ""
-        for plan_type, plan_content in PLANS.items():
-            source_link = f" ([source]({plan_content['source_link']}))" if 'source_link' in plan_content else ""
-            plans_text += f"• `{plan_type}` - {plan_content['name']}{source_link}\n"
-        
-        embed.add_field(name="Available Reading Plans", value=plans_text, inline=False)
-        
         channel = self.get_destination()
-        await channel.send(embed=embed)
+        await channel.send(embed=render_help(self.context.clean_prefix))
 
 bot.help_command = BibleReadingBotHelp()
 
-# Helper functions
-def format_plan_name(plan_content: dict) -> str:
-    """Format plan name with source link if available"""
-    name = plan_content["name"]
-    return f'[{name}]({plan_content["source_link"]})' if 'source_link' in plan_content else name
+# The help command above only answers !help, so slash commands get their own
+@bot.tree.command(name='help')
+async def slash_help(interaction: discord.Interaction):
+    """List the bot's commands and the available reading plans"""
+    await interaction.response.send_message(embed=render_help('/'))
 
+# Helper functions
 def get_plan_content(plan_type: str):
     """Get plan content and validate plan type exists"""
     plan_type = plan_type.lower()
@@ -92,7 +599,7 @@ def get_plan_content(plan_type: str):
 
 def get_plan_length(plan_type: str) -> int:
     """Get the number of days in a reading plan"""
-    return len(PLANS[plan_type]["readings"])
+    return PLANS[plan_type].length
 
 def normalize_day(day: int, plan_type: str) -> int:
     """Normalize the day to be within the plan's length.
@@ -102,50 +609,16 @@ def normalize_day(day: int, plan_type: str) -> int:
         return 0
     return day
 
-async def send_daily_reading(ctx, plan: dict) -> str:
-    """Get formatted daily reading message for a plan"""
-    day = plan["current_day"]
-    plan_content = PLANS[plan["plan_type"]]  # Now using plan_type from db
-    paused_text = " (Paused)" if plan["paused"] else ""
-
-    reading_header = f'{format_plan_name(plan_content)}, Daily Reading {day + 1}{paused_text} --'
-    readings = plan_content["readings"][day]
-
-    p_type = plan_content['type']
-    if p_type == 'bible_calendar':
-        await ctx.send(f'{reading_header} **{", ".join(readings)}**')
-    elif p_type == 'book':
-        await ctx.send(f'**{reading_header}**')
-        for reading in readings:        
-            # Split text into chunks of max 2000 chars (Discord limit)
-            chunks = []
-            current_chunk = []
-            current_length = 0
-            
-            # Split by words to avoid breaking words
-            words = reading.split()
-            for word in words:
-                # Add 1 for the space after the word
-                word_length = len(word) + 1
-                
-                # If adding this word would exceed limit, start new chunk
-                if current_length + word_length > 2000 and current_chunk:
-                    chunks.append(' '.join(current_chunk))
-                    current_chunk = []
-                    current_length = 0
-                
-                current_chunk.append(word)
-                current_length += word_length
-            
-            # Add remaining text as final chunk
-            if current_chunk:
-                chunks.append(' '.join(current_chunk))
-            
-            # Send header and chunks
-            for chunk in chunks:
-                await ctx.send(chunk)
-    else:
-        await ctx.send(f'Unsupported plan type: {p_type}')
+async def send_payload(channel, payload: dict):
+    """Send a rendered payload, turning embed dicts into discord.Embeds"""
+    if 'embeds' in payload:
+        payload = {**payload, 'embeds': [discord.Embed.from_dict(e) for e in payload['embeds']]}
+    await channel.send(**payload)
+
+async def send_daily_reading(ctx, plan: dict):
+    """Send the daily reading message(s) for a plan"""
+    for payload in render_daily_reading(plan, embeds=args.embeds):
+        await send_payload(ctx, payload)
 
 async def validate_plan(ctx, plan_type: str, check_exists: bool = True) -> tuple:
     """Validate plan type and get plan data. Returns (plan_content, plan) tuple.
@@ -158,7 +631,7 @@ async def validate_plan(ctx, plan_type: str, check_exists: bool = True) -> tuple
         await ctx.send(f'`{plan_type}` is not a supported plan!')
         return None, None
         
-    plan = db.get_plan_by_channel_and_type(ctx.message.channel.id, plan_type)
+    plan = await adb.get_plan_by_channel_and_type(ctx.message.channel.id, plan_type)
     
     if check_exists and not plan:
         await ctx.send(f'{format_plan_name(plan_content)} not running for this channel!')
@@ -169,11 +642,17 @@ async def validate_plan(ctx, plan_type: str, check_exists: bool = True) -> tuple
         
     return plan_content, plan
 
-# Define bot commands
-@bot.command()
+async def plan_type_autocomplete(interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+    """Suggest plan types containing what has been typed so far"""
+    matches = [plan_type for plan_type in PLANS if current.lower() in plan_type]
+    # Discord shows at most 25 choices
+    return [app_commands.Choice(name=plan_type, value=plan_type) for plan_type in matches[:25]]
+
+# Define bot commands. Each is a slash command, and also a !command with --prefix-commands
+@bot.hybrid_command()
 async def plans(ctx):
     """Lists all active reading plans in the current channel"""
-    plans = db.get_plans_by_channel(ctx.message.channel.id)
+    plans = await adb.get_plans_by_channel(ctx.message.channel.id)
 
     if plans:
         message = ''
@@ -181,25 +660,31 @@ async def plans(ctx):
             plan_content = PLANS[p["plan_type"]]  # Now using plan_type from db
             message += f'{format_plan_name(plan_content)} (`{p["plan_type"]}`): Current Day - {p["current_day"] + 1}, Paused - {"Yes" if p["paused"] else "No"}\n'
     else:
-        message = 'No reading plans found. Try adding one with !start <type> from the following list:\n'
-        for plan_type, plan_content in PLANS.items():
-            message += f'- `{plan_type}` ({format_plan_name(plan_content)})\n'
+        message = render_plan_list(ctx.prefix)
             
     await ctx.send(message)
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.autocomplete(plan_type=plan_type_autocomplete)
 async def start(ctx, plan_type: str):
     """Start a new reading plan in the current channel"""
+    # Rendering the first reading can take longer than Discord waits for a slash command reply
+    await ctx.defer()
     plan_content, _ = await validate_plan(ctx, plan_type, check_exists=False)
     if plan_content:
-        plan_id = db.create_plan(ctx.message.channel.id, plan_type)
+        plan_id = await adb.create_plan(ctx.message.channel.id, plan_type, guild_id=ctx.guild.id if ctx.guild else 0)
+        if plan_id is None:
+            # Lost a race with a concurrent !start for the same plan
+            await ctx.send(f'{format_plan_name(plan_content)} already running in this channel!')
+            return
         await ctx.send(f'{format_plan_name(plan_content)} started!')
 
         # Also post the reading for the newly started plan
-        plan = db.get_plan(plan_id)
+        plan = await adb.get_plan(plan_id)
         await send_daily_reading(ctx, plan)
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.autocomplete(plan_type=plan_type_autocomplete)
 async def pause(ctx, plan_type: str):
     """Pause a reading plan to temporarily stop receiving daily readings"""
     plan_content, plan = await validate_plan(ctx, plan_type)
@@ -208,10 +693,11 @@ async def pause(ctx, plan_type: str):
             await ctx.send(f'{format_plan_name(plan_content)} is already paused!')
             return
 
-        db.update_plan(plan['id'], paused=True)
+        await adb.update_plan(plan['id'], paused=True)
         await ctx.send(f'{format_plan_name(plan_content)} paused!')
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.autocomplete(plan_type=plan_type_autocomplete)
 async def resume(ctx, plan_type: str):
     """Resume a previously paused reading plan"""
     plan_content, plan = await validate_plan(ctx, plan_type)
@@ -220,11 +706,12 @@ async def resume(ctx, plan_type: str):
             await ctx.send(f'{format_plan_name(plan_content)} is not paused!')
             return
         
-        db.update_plan(plan['id'], paused=False)
+        await adb.update_plan(plan['id'], paused=False)
         await ctx.send(f'{format_plan_name(plan_content)} resumed!')
 
-@bot.command()
-async def set(ctx, plan_type: str, day: int):
+@bot.hybrid_command()
+@app_commands.autocomplete(plan_type=plan_type_autocomplete)
+async def set(ctx, plan_type: str, day: commands.Range[int, 1, None]):
     """Set the current day for a reading plan"""
     plan_content, plan = await validate_plan(ctx, plan_type)
     if plan:
@@ -239,25 +726,161 @@ async def set(ctx, plan_type: str, day: int):
             normalized_day = zero_based_day
             await ctx.send(f'{format_plan_name(plan_content)} set to day {day}!')
             
-        db.update_plan(plan['id'], current_day=normalized_day)
+        await adb.update_plan(plan['id'], current_day=normalized_day)
 
-@bot.command()
+@bot.hybrid_command()
 async def readings(ctx):
     """Get the current reading plan for the channel"""
-    plans = db.get_plans_by_channel(ctx.message.channel.id)
+    await ctx.defer()
+    plans = await adb.get_plans_by_channel(ctx.message.channel.id)
     if not plans:
         await ctx.send('No reading plans found!')
         return
 
-    for plan in plans:
-        await send_daily_reading(ctx, plan)
+    # Send every plan's reading in as few messages as possible
+    for payload, _ in pack_payloads([render_daily_reading(plan, embeds=args.embeds) for plan in plans]):
+        await send_payload(ctx, payload)
 
-@bot.command()
+@bot.hybrid_command()
+@app_commands.autocomplete(plan_type=plan_type_autocomplete)
 async def stop(ctx, plan_type: str):
     """Stop and remove a reading plan from the channel"""
     plan_content, plan = await validate_plan(ctx, plan_type)
     if plan:
-        db.delete_plan(plan['id'])
+        await adb.delete_plan(plan['id'])
+        plan_timers.cancel(plan['id'])
         await ctx.send(f'{format_plan_name(plan_content)} stopped!')
 
-bot.run(os.environ['TOKEN'])
+@bot.hybrid_command(name='time')
+@app_commands.autocomplete(plan_type=plan_type_autocomplete)
+async def publish_time(ctx, plan_type: str, at: str, timezone: str = None):
+    """Publish a reading plan daily at its own time (HH:MM) and timezone, or `off` to undo"""
+    plan_content, plan = await validate_plan(ctx, plan_type)
+    if plan:
+        if at.lower() == 'off':
+            await adb.set_publish_time(plan['id'], None)
+            plan_timers.cancel(plan['id'])
+            await ctx.send(f'{format_plan_name(plan_content)} will be published on the default schedule!')
+            return
+
+        try:
+            publish_at = parse_time(at)
+            if timezone:
+                ZoneInfo(timezone)
+        except (ValueError, ZoneInfoNotFoundError):
+            await ctx.send(f'Usage: `{ctx.prefix}time <type> <HH:MM> [timezone]`, e.g. `{ctx.prefix}time mcheyne 06:30 America/Chicago`')
+            return
+
+        await adb.set_publish_time(plan['id'], publish_at.strftime('%H:%M'), timezone)
+        plan_timers.schedule(plan['id'], publish_at, timezone)
+        await ctx.send(f'{format_plan_name(plan_content)} will be published daily at {publish_at.strftime("%H:%M")} {timezone or "server time"}!')
+
+def run_shard_processes() -> int:
+    """Run the shards split into --processes ranges, each in its own bot process sharing the database
+
+    Returns the worst exit code of the processes.
+    """
+    all_ids = shard_ids or list(range(args.shard_count))
+    size = -(-len(all_ids) // args.processes)
+    ranges = [all_ids[i:i + size] for i in range(0, len(all_ids), size)]
+
+    # Later arguments win, so each child runs one range as a single process
+    children = [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), *sys.argv[1:],
+                          '--processes', '1', '--shard-ids', ','.join(map(str, ids)),
+                          '--rate-share', str(args.rate_share * len(ranges))])
+        for ids in ranges
+    ]
+    try:
+        return max(child.wait() for child in children)
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+
+@bot.hybrid_command(name='metrics')
+@commands.is_owner()
+@app_commands.default_permissions(administrator=True)
+async def show_metrics(ctx):
+    """Show command, database and send latencies and error counts (bot owner only)"""
+    # Code blocks add 8 characters to each message
+    for chunk in iter_chunks(metrics.summary().split('\n'), limit=MESSAGE_LIMIT - 8, separator='\n'):
+        await ctx.send(f'```\n{chunk}\n```')
+
+@bot.hybrid_command(name='memory')
+@commands.is_owner()
+@app_commands.default_permissions(administrator=True)
+async def show_memory(ctx):
+    """Show the bot's memory use and the size of each of its caches (bot owner only)"""
+    rss, peak = profiling.memory_usage()
+    guilds = len(bot.guilds)
+    render_cache = render.cache_info()
+    lines = [
+        f'RSS: {rss / 2**20:.1f} MiB (peak {peak / 2**20:.1f} MiB), {rss / max(guilds, 1) / 1024:.1f} KiB per guild',
+        f'Guilds: {guilds}',
+        f'Channels: {sum(len(guild.channels) for guild in bot.guilds)} in guilds, {len(bot.private_channels)} private',
+        f'Members: {sum(len(guild.members) for guild in bot.guilds)}, users: {len(bot.users)}',
+        f'Messages: {len(bot.cached_messages)}',
+        f'Plan cache: {len(adb.channel_cache.entries)} channels, {len(adb.channel_cache.plan_channels)} plans '
+        f'({adb.channel_cache.hits} hits, {adb.channel_cache.misses} misses)',
+        f'Rendered readings: {render_cache.currsize}/{render_cache.maxsize} ({render_cache.hits} hits, {render_cache.misses} misses)',
+        f'Plans loaded: {len(PLANS)}, timed plans: {len(plan_timers.plans)}',
+    ]
+    await ctx.send('```\n' + '\n'.join(lines) + '\n```')
+
+# Whether an owner's !profile sample is running
+sampling = False
+
+@bot.hybrid_command(name='profile')
+@commands.is_owner()
+@app_commands.default_permissions(administrator=True)
+async def sample_profile(ctx, seconds: commands.Range[float, 1, 600] = 30.0):
+    """Profile the running bot for a while and post the results (bot owner only)"""
+    global sampling
+    if sampling or args.profile:
+        await ctx.send('The bot is already being profiled!')
+        return
+
+    sampling = True
+    profile = cProfile.Profile()
+    try:
+        await ctx.send(f'Profiling for {seconds:g}s...')
+        profile.enable()
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+        sampling = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'profile.pstats')
+        profiling.dump(profile, path)
+        await ctx.send(f'Profile of the last {seconds:g}s, with stage timings since startup:',
+                       files=[discord.File(path), discord.File(f'{path}.txt', 'profile.txt')])
+
+if __name__ == '__main__':
+    if args.profile:
+        profiling.start(args.profile)
+    if args.worker:
+        discord.utils.setup_logging()
+        with profiling.stage('startup: parse env'):
+            load_env()
+        asyncio.run(run_worker())
+        adb.shutdown()
+        sys.exit()
+    if args.publish and args.workers:
+        # Queueing needs no gateway connection; the workers send over HTTP
+        discord.utils.setup_logging()
+        asyncio.run(publish_readings(args.publish_date or date.today().isoformat()))
+        adb.shutdown()
+        sys.exit()
+    if args.processes > 1:
+        # Migrations already ran on import, before any child opens the database
+        sys.exit(run_shard_processes())
+
+    with profiling.stage('startup: parse env'):
+        load_env()
+    bot.run(os.environ['TOKEN'])
+
+    # Flush any queued database work once the bot has disconnected
+    adb.shutdown()
+
@@ -0,0 +1,137 @@
+"""In-memory cache of each channel's plan rows for the command handlers.
+
+Entries are loaded lazily, kept up to date by adb.py as it writes, and
+evicted least recently used first past a size limit. Entries also expire
+after a while so changes made by other processes (a cron --publish run,
+publish workers) are picked up. Bulk writes that touch many channels at
+once simply clear the cache.
+
+Plans are held as CachedPlan records rather than dicts, which take less than
+half the memory of a row dict, and are handed out as dicts.
+"""
+import sys
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+CACHE_SIZE = 10000
+CACHE_TTL = 60.0
+
+# The columns of the plans table; add any a migration adds
+PLAN_COLUMNS = ('id', 'channel_id', 'plan_type', 'current_day', 'paused', 'created_at', 'updated_at',
+                'publish_time', 'timezone', 'guild_id')
+
+class CachedPlan:
+    """A plan row with its fields in slots instead of a per-row dict."""
+    __slots__ = PLAN_COLUMNS
+
+    def __init__(self, row: dict):
+        for name in PLAN_COLUMNS:
+            value = row[name]
+            # Shared by every plan of a type (or in a timezone), so keep one copy
+            setattr(self, name, sys.intern(value) if name in ('plan_type', 'timezone') and value else value)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in PLAN_COLUMNS}
+
+class ChannelCache:
+    """LRU cache of channel_id -> that channel's plan rows."""
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL,
+                 clock: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        # channel_id -> (expiry, [CachedPlan])
+        self.entries: OrderedDict = OrderedDict()
+        # plan_id -> channel_id of every cached plan
+        self.plan_channels: Dict[int, int] = {}
+        # Bumped on every write, so a read that raced a write isn't cached
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, channel_id: int) -> Optional[List[dict]]:
+        """Copies of a channel's cached plans, or None if it isn't cached."""
+        entry = self.entries.get(channel_id)
+        if entry is None or entry[0] < self.clock():
+            if entry is not None:
+                self.drop(channel_id)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(channel_id)
+        self.hits += 1
+        return [p.to_dict() for p in entry[1]]
+
+    def find(self, plan_id: int) -> Optional[dict]:
+        """A copy of a cached plan by ID, or None if it isn't cached."""
+        channel_id = self.plan_channels.get(plan_id)
+        if channel_id is None:
+            return None
+        return next((p for p in self.get(channel_id) or () if p['id'] == plan_id), None)
+
+    def put(self, channel_id: int, plans: List[dict], version: int):
+        """Cache a channel's plans as read at `version`, unless something was written since."""
+        if version != self.version:
+            return
+        self.drop(channel_id)
+        self.entries[channel_id] = (self.clock() + self.ttl, [CachedPlan(p) for p in plans])
+        self.plan_channels.update((p['id'], channel_id) for p in plans)
+        while len(self.entries) > self.maxsize:
+            self.drop(next(iter(self.entries)))
+
+    def add(self, plan: dict):
+        """Write through a newly created plan.
+
+        A read that ran after the insert may have cached the plan already, so
+        a record with its ID is replaced rather than added again.
+        """
+        self.version += 1
+        entry = self.entries.get(plan['channel_id'])
+        if entry is not None:
+            plans = [p for p in entry[1] if p.id != plan['id']]
+            plans.append(CachedPlan(plan))
+            self.entries[plan['channel_id']] = (entry[0], plans)
+            self.plan_channels[plan['id']] = plan['channel_id']
+
+    def update(self, plan_id: int, **fields):
+        """Write through changed fields of a plan."""
+        self.version += 1
+        channel_id = self.plan_channels.get(plan_id)
+        if channel_id is None:
+            return
+        if 'channel_id' in fields or 'plan_type' in fields:
+            # Moves between channels or changes its key; reload instead
+            self.drop(channel_id)
+            return
+        for plan in self.entries[channel_id][1]:
+            if plan.id == plan_id:
+                for name, value in fields.items():
+                    setattr(plan, name, value)
+
+    def remove(self, plan_id: int):
+        """Write through a deleted plan."""
+        self.version += 1
+        channel_id = self.plan_channels.pop(plan_id, None)
+        if channel_id is not None:
+            expiry, plans = self.entries[channel_id]
+            self.entries[channel_id] = (expiry, [p for p in plans if p.id != plan_id])
+
+    def drop_plans(self, plan_ids: List[int]):
+        """Forget the channels of some plans, e.g. after a write touching only those."""
+        self.version += 1
+        for channel_id in {self.plan_channels.get(plan_id) for plan_id in plan_ids} - {None}:
+            self.drop(channel_id)
+
+    def drop(self, channel_id: int):
+        """Forget a channel's entry."""
+        entry = self.entries.pop(channel_id, None)
+        if entry is not None:
+            for plan in entry[1]:
+                self.plan_channels.pop(plan.id, None)
+
+    def clear(self):
+        """Forget everything, e.g. after a write touching many channels."""
+        self.version += 1
+        self.entries.clear()
+        self.plan_channels.clear()
@@ -0,0 +1,75 @@
+"""Streaming text chunker for Discord's message length limit.
+
+iter_chunks packs consecutive paragraphs into shared chunks and, when a
+paragraph doesn't fit, splits it at the last sentence boundary that fits,
+then at the last whitespace, and only as a last resort mid-word. Chunks
+are slices of the original text, so line breaks and spacing inside them are
+kept; only whitespace at a split point is dropped.
+"""
+import re
+from typing import Iterable, Iterator
+from plan_store import MESSAGE_LIMIT
+
+# Placed between paragraphs that share a chunk
+PARAGRAPH_SEPARATOR = '\n\n'
+
+# End of a sentence: terminal punctuation, optional closing quotes/brackets, then whitespace
+SENTENCE_END = re.compile(r'[.!?]["\'”’)\]]*(?=\s)')
+WHITESPACE = re.compile(r'\s+')
+
+def find_split(text: str, start: int, limit: int) -> int:
+    """Index to end a chunk of text[start:] at, at most `limit` chars from start."""
+    end = start + limit
+    window = text[start:end + 1]
+
+    # Last sentence end that fits, unless it would leave the chunk under half full
+    sentence_end = -1
+    for match in SENTENCE_END.finditer(window, limit // 2, limit):
+        sentence_end = match.end()
+    if sentence_end > 0:
+        return start + sentence_end
+
+    # Otherwise the last whitespace (the character right after the limit counts too)
+    space = max(window.rfind(' '), window.rfind('\n'), window.rfind('\t'))
+    if space > 0:
+        return start + space
+
+    # A single word longer than the limit
+    return end
+
+def split_text(text: str, limit: int = MESSAGE_LIMIT) -> Iterator[str]:
+    """Yield pieces of one paragraph, each at most `limit` chars. A blank paragraph yields nothing."""
+    if text.isspace():
+        # Nothing Discord would send, and padding if packed with others
+        return
+    start, length = 0, len(text)
+    while length - start > limit:
+        split = find_split(text, start, limit)
+        yield text[start:split].rstrip()
+        # Skip the whitespace the split landed on
+        match = WHITESPACE.match(text, split)
+        start = match.end() if match else split
+    if start < length:
+        yield text[start:]
+
+def iter_chunks(paragraphs: Iterable[str], limit: int = MESSAGE_LIMIT,
+                separator: str = PARAGRAPH_SEPARATOR) -> Iterator[str]:
+    """Yield chunks of at most `limit` chars, packing consecutive paragraphs together."""
+    buffer = []
+    buffered = 0
+    for paragraph in paragraphs:
+        for index, piece in enumerate(split_text(paragraph, limit)):
+            # Only a paragraph's first piece may join the previous chunk; later
+            # pieces continue it, so a separator there would invent a break
+            if buffer and index == 0 and buffered + len(separator) + len(piece) <= limit:
+                buffer.append(piece)
+                buffered += len(separator) + len(piece)
+                continue
+
+            if buffer:
+                yield separator.join(buffer)
+            buffer = [piece]
+            buffered = len(piece)
+
+    if buffer:
+        yield separator.join(buffer)
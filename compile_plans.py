@@ -0,0 +1,49 @@
+"""Validate and compile the JSON plans in plans/ for the bot to load.
+
+Run this at deploy time so the bot starts from prebuilt artifacts:
+
+    python compile_plans.py           # compile every plan
+    python compile_plans.py --check   # only validate, write nothing
+"""
+import argparse
+import json
+import os
+import sys
+from plan_store import COMPILED_DIR, PLANS_DIR, PlanError, check_plan, compile_plan
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Validate and compile reading plans')
+    parser.add_argument('plans', nargs='*', help='Plan types to compile (default: every plan)')
+    parser.add_argument('--source', default=PLANS_DIR, help='Directory of JSON plans')
+    parser.add_argument('--out', default=COMPILED_DIR, help='Directory to write compiled plans to')
+    parser.add_argument('--check', action='store_true', help='Validate plans without writing artifacts')
+    args = parser.parse_args()
+
+    plan_types = args.plans or sorted(os.path.splitext(p)[0] for p in os.listdir(args.source) if p.endswith('.json'))
+    os.makedirs(args.out, exist_ok=True)
+
+    failed = 0
+    for plan_type in plan_types:
+        source_path = os.path.join(args.source, f'{plan_type}.json')
+        try:
+            if args.check:
+                with open(source_path, 'rb') as f:
+                    errors = check_plan(json.load(f))
+                if errors:
+                    raise PlanError(f'{source_path}: ' + '; '.join(errors))
+                print(f'{plan_type}: ok')
+                continue
+
+            header = compile_plan(source_path, os.path.join(args.out, f'{plan_type}.plan'))
+        except (OSError, ValueError) as e:
+            print(f'{plan_type}: {e}', file=sys.stderr)
+            failed += 1
+            continue
+
+        print(f'{plan_type}: {header["length"]} days, {sum(header["day_bytes"])} bytes, '
+              f'{sum(header["day_words"])} words, sha256 {header["hash"][:12]}')
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
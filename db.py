@@ -1,85 +1,248 @@
+import json
 import sqlite3
-from typing import List, Optional, Tuple
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
 import os
 from datetime import datetime
 
-DB_PATH = 'data.sqlite3'
+# Overridable so tools like the benchmarks can point at a scratch database
+DB_PATH = os.environ.get('DB_PATH', 'data.sqlite3')
+
+# A single long-lived connection shared by every call. Access is serialized
+# with a lock so it can be used from the async executor thread (see adb.py)
+# as well as from plain synchronous callers.
+_conn = None
+_lock = threading.RLock()
+
+# Claims of a delivery before publish workers give up on it
+MAX_DELIVERY_ATTEMPTS = 3
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
+# The plans columns carried by export_plans/import_plans. IDs are left out
+# since they are local to each database
+PLAN_EXPORT_COLUMNS = ('channel_id', 'guild_id', 'plan_type', 'current_day', 'paused', 'publish_time', 'timezone',
+                       'created_at')
+
+# Migrations starting with this line run outside of a transaction (e.g. VACUUM)
+NO_TRANSACTION = '-- migrate: no-transaction'
+
+def get_migrations() -> List[Tuple[int, str]]:
+    """List (version, path) for every migration file, ordered by version.
+
+    Raises ValueError if two files share a version number.
+    """
+    migrations = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        if name.endswith('.sql'):
+            version = int(name.split('_', 1)[0])
+            migrations.append((version, os.path.join(MIGRATIONS_DIR, name)))
+    migrations.sort()
+    for (version, path), (next_version, next_path) in zip(migrations, migrations[1:]):
+        if version == next_version:
+            raise ValueError(f'Migrations {path} and {next_path} share version {version}')
+    return migrations
+
+def split_statements(sql: str) -> List[str]:
+    """Split a SQL script into its statements (trigger bodies included)."""
+    statements, statement = [], ''
+    for line in sql.splitlines(keepends=True):
+        statement += line
+        if sqlite3.complete_statement(statement):
+            statements.append(statement)
+            statement = ''
+    if statement.strip():
+        # A last statement without a semicolon
+        statements.append(statement)
+    return statements
 
 def init_db():
-    """Initialize the database and create tables if they don't exist."""
-    if not os.path.exists(DB_PATH):
-        conn = sqlite3.connect(DB_PATH)
-        with open('schema.sql', 'r') as f:
-            conn.executescript(f.read())
-        
-        # Create trigger for auto-updating updated_at
-        conn.executescript('''
-            CREATE TRIGGER IF NOT EXISTS update_plans_timestamp 
-            AFTER UPDATE ON plans
-            BEGIN
-                UPDATE plans SET updated_at = CURRENT_TIMESTAMP
-                WHERE id = NEW.id;
-            END;
-        ''')
-        conn.close()
+    """Initialize the database, applying any migrations newer than its schema version."""
+    with _lock:
+        conn = get_db()
+        for migration_version, path in get_migrations():
+            if migration_version <= conn.execute('PRAGMA user_version').fetchone()[0]:
+                continue
+
+            with open(path, 'r') as f:
+                sql = f.read()
+
+            no_transaction = sql.startswith(NO_TRANSACTION)
+            if no_transaction:
+                # Can't run inside the lock below, so these must be safe to rerun
+                conn.executescript(sql)
+
+            # Other processes sharing the database may be migrating it too, so
+            # take the write lock and check the version again before applying.
+            # The version is bumped in the same transaction so a failed
+            # migration is retried on the next start
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                if conn.execute('PRAGMA user_version').fetchone()[0] < migration_version:
+                    if not no_transaction:
+                        for statement in split_statements(sql):
+                            conn.execute(statement)
+                    conn.execute(f'PRAGMA user_version = {migration_version}')
+                conn.commit()
+            except sqlite3.Error:
+                conn.rollback()
+                raise
 
 def get_db():
-    """Get database connection with row factory."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Get the shared database connection with row factory, opening it on first use."""
+    global _conn
+    with _lock:
+        if _conn is None:
+            # Shard processes share the file, so wait out each other's write locks
+            _conn = sqlite3.connect(DB_PATH, timeout=30, check_same_thread=False)
+            _conn.row_factory = sqlite3.Row
+            # Connection-level tuning; WAL itself is persisted by a migration.
+            # NORMAL is durable across app crashes in WAL mode and only syncs
+            # at checkpoints instead of on every commit.
+            _conn.execute('PRAGMA synchronous = NORMAL')
+            _conn.execute('PRAGMA temp_store = MEMORY')
+        return _conn
+
+def close_db():
+    """Close the shared database connection if it is open."""
+    global _conn
+    with _lock:
+        if _conn is not None:
+            _conn.close()
+            _conn = None
+
+@contextmanager
+def transaction():
+    """Hold the shared connection for one unit of work, committing on success."""
+    with _lock:
+        conn = get_db()
+        with conn:
+            yield conn
 
 # Create
-def create_plan(channel_id: int, plan_type: str, current_day: int = 0, paused: bool = False) -> int:
-    """Create a new plan entry and return its ID."""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute(
-        '''INSERT INTO plans (channel_id, plan_type, current_day, paused, created_at, updated_at)
-           VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)''',
-        (channel_id, plan_type, current_day, paused)
-    )
-    conn.commit()
-    last_id = cursor.lastrowid
-    conn.close()
-    return last_id
+def create_plan(channel_id: int, plan_type: str, current_day: int = 0, paused: bool = False,
+                guild_id: Optional[int] = None) -> Optional[int]:
+    """Create a new plan entry and return its ID, or None if the channel already has that plan."""
+    try:
+        with transaction() as conn:
+            cursor = conn.execute(
+                '''INSERT INTO plans (channel_id, plan_type, current_day, paused, guild_id, created_at, updated_at)
+                   VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, CURRENT_TIMESTAMP)''',
+                (channel_id, plan_type, current_day, paused, guild_id)
+            )
+            return cursor.lastrowid
+    except sqlite3.IntegrityError:
+        return None
+
+def import_plans(plans: List[dict], replace: bool = False) -> int:
+    """Insert plans given as PLAN_EXPORT_COLUMNS dicts in one transaction and return how many were written.
+
+    A plan whose channel already has one of that type is skipped, or with
+    `replace` overwrites it, keeping its ID.
+    """
+    columns = ', '.join(PLAN_EXPORT_COLUMNS)
+    # Plans exported without a creation time are created now
+    values = ', '.join(f':{column}' for column in PLAN_EXPORT_COLUMNS).replace(
+        ':created_at', 'COALESCE(:created_at, CURRENT_TIMESTAMP)')
+    if replace:
+        updates = ', '.join(f'{column} = excluded.{column}' for column in PLAN_EXPORT_COLUMNS if column != 'created_at')
+        conflict = f'DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP'
+    else:
+        conflict = 'DO NOTHING'
+    with transaction() as conn:
+        before = conn.total_changes
+        conn.executemany(
+            f'''INSERT INTO plans ({columns}, updated_at)
+                VALUES ({values}, CURRENT_TIMESTAMP)
+                ON CONFLICT (channel_id, plan_type) {conflict}''',
+            plans
+        )
+        return conn.total_changes - before
 
 # Read
 def get_plan(plan_id: int) -> Optional[dict]:
     """Get a plan by its ID."""
-    conn = get_db()
-    plan = conn.execute('SELECT * FROM plans WHERE id = ?', (plan_id,)).fetchone()
-    conn.close()
+    with transaction() as conn:
+        plan = conn.execute('SELECT * FROM plans WHERE id = ?', (plan_id,)).fetchone()
     return dict(plan) if plan else None
 
 def get_plan_by_channel_and_type(channel_id: int, plan_type: str) -> Optional[dict]:
     """Get plan for a specific channel and plan type."""
-    conn = get_db()
-    plan = conn.execute('SELECT * FROM plans WHERE channel_id = ? AND plan_type = ?', (channel_id, plan_type)).fetchone()
-    conn.close()
+    with transaction() as conn:
+        plan = conn.execute('SELECT * FROM plans WHERE channel_id = ? AND plan_type = ?', (channel_id, plan_type)).fetchone()
     return dict(plan) if plan else None
 
 def get_plans_by_channel(channel_id: int) -> List[dict]:
     """Get all plans for a specific channel."""
-    conn = get_db()
-    plans = conn.execute('SELECT * FROM plans WHERE channel_id = ?', (channel_id,)).fetchall()
-    conn.close()
+    with transaction() as conn:
+        plans = conn.execute('SELECT * FROM plans WHERE channel_id = ?', (channel_id,)).fetchall()
     return [dict(p) for p in plans]
 
 def get_all_plans() -> List[dict]:
     """Get all plans."""
-    conn = get_db()
-    plans = conn.execute('SELECT * FROM plans').fetchall()
-    conn.close()
+    with transaction() as conn:
+        plans = conn.execute('SELECT * FROM plans').fetchall()
+    return [dict(p) for p in plans]
+
+def export_plans(batch_size: int = 10000) -> Iterator[dict]:
+    """Yield every plan's PLAN_EXPORT_COLUMNS in ID order, reading a batch per transaction.
+
+    Each batch releases the connection, so exporting a large table doesn't
+    hold up other callers.
+    """
+    last_id = 0
+    while True:
+        with transaction() as conn:
+            plans = conn.execute(
+                f'SELECT id, {", ".join(PLAN_EXPORT_COLUMNS)} FROM plans WHERE id > ? ORDER BY id LIMIT ?',
+                (last_id, batch_size)
+            ).fetchall()
+        for p in plans:
+            yield {column: p[column] for column in PLAN_EXPORT_COLUMNS}
+        if len(plans) < batch_size:
+            return
+        last_id = plans[-1]['id']
+
+def shard_condition(shard: Optional[Tuple[int, List[int]]]) -> Tuple[str, tuple]:
+    """SQL condition (and its params) matching plans on a (shard_count, shard_ids) subset of shards.
+
+    Uses Discord's shard formula, (guild_id >> 22) % shard_count. Plans whose
+    guild hasn't been looked up yet match no shard. With shard None every plan matches.
+    """
+    if shard is None:
+        return '1', ()
+    shard_count, shard_ids = shard
+    return ('guild_id IS NOT NULL AND (guild_id >> 22) % ? IN (SELECT value FROM json_each(?))',
+            (shard_count, json.dumps(shard_ids)))
+
+def get_publish_plans(shard: Optional[Tuple[int, List[int]]] = None) -> List[dict]:
+    """Get the plans the default publish run covers: those without their own publish time."""
+    selection, params = plan_selection(None, shard)
+    with transaction() as conn:
+        plans = conn.execute(f'SELECT * FROM plans WHERE {selection}', params).fetchall()
     return [dict(p) for p in plans]
 
+def get_outbox(channel_ids: List[int]) -> Dict[int, Tuple[str, str]]:
+    """Get the pre-rendered (state, messages) of each of some channels that has them."""
+    with transaction() as conn:
+        rows = conn.execute(
+            'SELECT channel_id, state, messages FROM outbox WHERE channel_id IN (SELECT value FROM json_each(?))',
+            (json.dumps(channel_ids),)
+        ).fetchall()
+    return {row['channel_id']: (row['state'], row['messages']) for row in rows}
+
+def get_unassigned_channels() -> List[int]:
+    """Get the channels of plans whose guild hasn't been recorded yet."""
+    with transaction() as conn:
+        rows = conn.execute('SELECT DISTINCT channel_id FROM plans WHERE guild_id IS NULL').fetchall()
+    return [row['channel_id'] for row in rows]
+
 # Update
-def update_plan(plan_id: int, channel_id: int = None, plan_type: str = None, 
+def update_plan(plan_id: int, channel_id: int = None, plan_type: str = None,
                 current_day: int = None, paused: bool = None) -> bool:
     """Update a plan's details. Only updates provided fields."""
-    conn = get_db()
-    cursor = conn.cursor()
-    
     # Build update query dynamically based on provided fields
     update_fields = []
     values = []
@@ -95,29 +258,223 @@ def update_plan(plan_id: int, channel_id: int = None, plan_type: str = None,
     if paused is not None:
         update_fields.append('paused = ?')
         values.append(paused)
-    
+
     if not update_fields:
         return False
-        
+
+    update_fields.append('updated_at = CURRENT_TIMESTAMP')
     query = f'''UPDATE plans SET {', '.join(update_fields)} WHERE id = ?'''
     values.append(plan_id)
-    
-    cursor.execute(query, values)
-    conn.commit()
-    success = cursor.rowcount > 0
-    conn.close()
-    return success
+
+    with transaction() as conn:
+        cursor = conn.execute(query, values)
+        return cursor.rowcount > 0
+
+def plan_selection(plan_ids: Optional[List[int]], shard: Optional[Tuple[int, List[int]]]) -> Tuple[str, tuple]:
+    """SQL condition (and its params) for the plans a publish covers."""
+    if plan_ids is None:
+        selection, params = 'publish_time IS NULL', ()
+    else:
+        selection, params = 'id IN (SELECT value FROM json_each(?))', (json.dumps(plan_ids),)
+    owned, owned_params = shard_condition(shard)
+    return f'{selection} AND {owned}', (*params, *owned_params)
+
+def enqueue_plans(plan_lengths: Dict[str, int], publish_date: str, plan_ids: Optional[List[int]] = None,
+                  shard: Optional[Tuple[int, List[int]]] = None) -> int:
+    """Advance plans for a publish date and queue a delivery for each, returning how many were queued.
+
+    Every unpaused plan not yet journaled for publish_date is advanced by one day,
+    wrapping to day 0 past the end of its plan (plan_lengths maps plan_type to its
+    number of days), and a delivery row recording the day to publish is written in
+    the same transaction. Plans already journaled are left alone, so rerunning a
+    publish date never advances a plan twice.
+
+    With plan_ids only those plans are published; otherwise every plan without its
+    own publish time is. With shard only plans on those shards are (see shard_condition).
+    """
+    selection, params = plan_selection(plan_ids, shard)
+    # A lookup on the deliveries primary key per plan, rather than reading
+    # every delivery of the date, so publishing a few plans stays cheap
+    unjournaled = 'NOT EXISTS (SELECT 1 FROM deliveries WHERE plan_id = plans.id AND publish_date = ?)'
+
+    with transaction() as conn:
+        conn.executemany(
+            f'''UPDATE plans
+               SET current_day = CASE WHEN current_day + 1 >= ? THEN 0 ELSE current_day + 1 END,
+                   updated_at = CURRENT_TIMESTAMP
+               WHERE paused = 0 AND plan_type = ? AND {selection} AND {unjournaled}''',
+            [(length, plan_type, *params, publish_date) for plan_type, length in plan_lengths.items()]
+        )
+        cursor = conn.execute(
+            f'''INSERT INTO deliveries (plan_id, publish_date, channel_id, plan_type, current_day, paused)
+               SELECT id, ?, channel_id, plan_type, current_day, paused FROM plans
+               WHERE plan_type IN (SELECT value FROM json_each(?)) AND {selection} AND {unjournaled}''',
+            (publish_date, json.dumps(list(plan_lengths)), *params, publish_date)
+        )
+        return cursor.rowcount
+
+def advance_plans(plan_lengths: Dict[str, int], publish_date: str, plan_ids: Optional[List[int]] = None,
+                  shard: Optional[Tuple[int, List[int]]] = None) -> List[dict]:
+    """Advance plans for a publish date (see enqueue_plans) and return their pending deliveries.
+
+    Deliveries already journaled for publish_date are included until they finish
+    sending, so rerunning a publish date only returns what is left to send.
+    """
+    enqueue_plans(plan_lengths, publish_date, plan_ids, shard)
+    selection, params = plan_selection(plan_ids, shard)
+    with transaction() as conn:
+        deliveries = conn.execute(
+            f'''SELECT * FROM deliveries
+               WHERE publish_date = ? AND completed_at IS NULL
+               AND plan_id IN (SELECT id FROM plans WHERE {selection})''',
+            (publish_date, *params)
+        ).fetchall()
+    return [dict(d) for d in deliveries]
+
+def claim_deliveries(worker: str, publish_date: str, channels: int, lease_seconds: float) -> List[dict]:
+    """Lease the pending deliveries of a publish date for up to `channels` channels to a worker and return them.
+
+    A channel's deliveries are claimed together so one worker keeps its messages
+    in order. Deliveries leased to another worker are skipped until the lease
+    expires, and ones already claimed MAX_DELIVERY_ATTEMPTS times are given up on.
+    Unfinished deliveries of other dates are never claimed, so an old reading
+    isn't sent days late.
+    """
+    now = time.time()
+    available = ('publish_date = ? AND completed_at IS NULL AND attempts < ? '
+                 'AND (lease_expires IS NULL OR lease_expires < ?)')
+    with transaction() as conn:
+        # Take the write lock up front so concurrent workers claim one after another
+        conn.execute('BEGIN IMMEDIATE')
+        deliveries = conn.execute(
+            f'''UPDATE deliveries SET leased_by = ?, lease_expires = ?, attempts = attempts + 1
+               WHERE {available} AND channel_id IN (
+                   SELECT channel_id FROM deliveries WHERE {available} GROUP BY channel_id LIMIT ?)
+               RETURNING *''',
+            (worker, now + lease_seconds, publish_date, MAX_DELIVERY_ATTEMPTS, now,
+             publish_date, MAX_DELIVERY_ATTEMPTS, now, channels)
+        ).fetchall()
+    return sorted((dict(d) for d in deliveries), key=lambda d: d['plan_id'])
+
+def renew_leases(worker: str, lease_seconds: float) -> int:
+    """Extend a worker's leases on its unfinished deliveries, returning how many it holds."""
+    with transaction() as conn:
+        cursor = conn.execute(
+            'UPDATE deliveries SET lease_expires = ? WHERE leased_by = ? AND completed_at IS NULL',
+            (time.time() + lease_seconds, worker)
+        )
+        return cursor.rowcount
+
+def release_deliveries(worker: str) -> int:
+    """Give up a worker's leases on its unfinished deliveries so they can be claimed again."""
+    with transaction() as conn:
+        cursor = conn.execute(
+            'UPDATE deliveries SET leased_by = NULL, lease_expires = NULL WHERE leased_by = ? AND completed_at IS NULL',
+            (worker,)
+        )
+        return cursor.rowcount
+
+def count_pending_deliveries(publish_date: str) -> int:
+    """Count a publish date's unfinished deliveries that workers haven't given up on, leased or not."""
+    with transaction() as conn:
+        row = conn.execute(
+            'SELECT COUNT(*) FROM deliveries WHERE publish_date = ? AND completed_at IS NULL AND attempts < ?',
+            (publish_date, MAX_DELIVERY_ATTEMPTS)
+        ).fetchone()
+    return row[0]
+
+def mark_delivery_sent(plan_id: int, publish_date: str, sent: int, completed: bool = False):
+    """Record how many of a delivery's messages have been sent, and whether that was all of them."""
+    with transaction() as conn:
+        conn.execute(
+            '''UPDATE deliveries SET sent = ?, completed_at = CASE WHEN ? THEN CURRENT_TIMESTAMP END
+               WHERE plan_id = ? AND publish_date = ?''',
+            (sent, completed, plan_id, publish_date)
+        )
+
+def prune_deliveries(days: int = 30) -> int:
+    """Delete deliveries journaled more than `days` days ago, returning how many were removed.
+
+    Unfinished ones go too, e.g. those of a deleted channel, which would
+    otherwise be kept forever.
+    """
+    with transaction() as conn:
+        cursor = conn.execute(
+            "DELETE FROM deliveries WHERE created_at < datetime('now', ?)",
+            (f'-{days} days',)
+        )
+        return cursor.rowcount
+
+def get_timed_plans(shard: Optional[Tuple[int, List[int]]] = None) -> List[dict]:
+    """Get all plans that have their own publish time, optionally only those on some shards."""
+    owned, params = shard_condition(shard)
+    with transaction() as conn:
+        plans = conn.execute(f'SELECT * FROM plans WHERE publish_time IS NOT NULL AND {owned}', params).fetchall()
+    return [dict(p) for p in plans]
+
+def set_publish_time(plan_id: int, publish_time: Optional[str], timezone: Optional[str] = None) -> bool:
+    """Set a plan's daily publish time (HH:MM) and timezone, or clear it with None."""
+    with transaction() as conn:
+        cursor = conn.execute(
+            '''UPDATE plans SET publish_time = ?, timezone = ?, updated_at = CURRENT_TIMESTAMP
+               WHERE id = ?''',
+            (publish_time, timezone if publish_time else None, plan_id)
+        )
+        return cursor.rowcount > 0
+
+def save_outbox(rows: List[Tuple[int, str, str]]) -> int:
+    """Store pre-rendered (channel_id, state, messages) rows, dropping those of channels without plans."""
+    with transaction() as conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO outbox (channel_id, state, messages) VALUES (?, ?, ?)',
+            rows
+        )
+        conn.execute('DELETE FROM outbox WHERE channel_id NOT IN (SELECT channel_id FROM plans)')
+    return len(rows)
+
+def set_channel_guilds(guilds: Dict[int, int]) -> int:
+    """Record the guild (0 for none) of each channel's plans, returning how many plans were updated."""
+    with transaction() as conn:
+        cursor = conn.executemany(
+            'UPDATE plans SET guild_id = ? WHERE channel_id = ?',
+            [(guild_id, channel_id) for channel_id, guild_id in guilds.items()]
+        )
+        return cursor.rowcount
+
+def normalize_plan_days(plan_type: str, plan_length: int) -> int:
+    """Wrap every plan of a type that is past the end of its plan back to day 0.
+
+    Returns the number of plans that were wrapped.
+    """
+    with transaction() as conn:
+        cursor = conn.execute(
+            '''UPDATE plans SET current_day = 0, updated_at = CURRENT_TIMESTAMP
+               WHERE plan_type = ? AND current_day >= ?''',
+            (plan_type, plan_length)
+        )
+        return cursor.rowcount
+
+def get_last_run(name: str) -> Optional[datetime]:
+    """Get when a named schedule last ran, if it ever has."""
+    with transaction() as conn:
+        row = conn.execute('SELECT last_run FROM scheduler_runs WHERE name = ?', (name,)).fetchone()
+    return datetime.fromisoformat(row['last_run']) if row else None
+
+def set_last_run(name: str, last_run: datetime):
+    """Record when a named schedule last ran."""
+    with transaction() as conn:
+        conn.execute(
+            '''INSERT INTO scheduler_runs (name, last_run) VALUES (?, ?)
+               ON CONFLICT (name) DO UPDATE SET last_run = excluded.last_run''',
+            (name, last_run.isoformat())
+        )
 
 # Delete
 def delete_plan(plan_id: int) -> bool:
     """Delete a plan by its ID. Returns True if successful."""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM plans WHERE id = ?', (plan_id,))
-    conn.commit()
-    success = cursor.rowcount > 0
-    conn.close()
-    return success
+    with transaction() as conn:
+        cursor = conn.execute('DELETE FROM plans WHERE id = ?', (plan_id,))
+        return cursor.rowcount > 0
 
 # Initialize the database when the module is imported
 init_db()
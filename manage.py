@@ -0,0 +1,190 @@
+"""Move the bot's plans between databases and back the database up.
+
+    python manage.py export plans.jsonl           # every plan as JSON lines
+    python manage.py export plans.csv             # or as CSV (by extension or --format)
+    python manage.py export - > plans.jsonl       # to stdout
+    python manage.py import plans.jsonl           # skip plans a channel already has
+    python manage.py import plans.csv --replace   # or overwrite them
+    python manage.py backup                       # into backups/, keeping the newest 7
+    python manage.py restore backups/data-20240101-030000-000000.sqlite3
+
+Everything but restore is safe while the bot is running. The database is
+DB_PATH (default data.sqlite3), as for the bot.
+"""
+import argparse
+import csv
+import json
+import os
+import sqlite3
+import sys
+from typing import Dict, Iterator, List
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import backup
+import db
+from scheduler import parse_time
+
+# Integer columns, which CSV gives as strings
+INTEGER_COLUMNS = ('channel_id', 'guild_id', 'current_day', 'paused')
+
+def file_format(path: str, given: str) -> str:
+    """The format given, else the one the file's extension names (JSONL by default)"""
+    if given:
+        return given
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+def parse_plan(row: dict, plan_lengths: Dict[str, int]) -> dict:
+    """Turn an exported row into an import_plans dict, converting CSV strings and blanks
+
+    Rows for plan types that aren't loaded, or with a time or timezone the bot
+    couldn't schedule, are rejected. A day past the end of its plan wraps to
+    day 1, as normalize_plan_days does when a plan is shortened.
+    """
+    plan = {column: None if row.get(column) == '' else row.get(column) for column in db.PLAN_EXPORT_COLUMNS}
+    for column in INTEGER_COLUMNS:
+        if plan[column] is not None:
+            plan[column] = int(plan[column])
+    if plan['channel_id'] is None or not plan['plan_type'] or plan['current_day'] is None:
+        raise ValueError('channel_id, plan_type and current_day are required')
+    if plan['plan_type'] not in plan_lengths:
+        raise ValueError(f'unknown plan type {plan["plan_type"]!r}')
+    if plan['current_day'] < 0:
+        raise ValueError(f'negative current_day {plan["current_day"]}')
+    if plan['current_day'] >= plan_lengths[plan['plan_type']]:
+        plan['current_day'] = 0
+    if plan['publish_time'] is not None:
+        plan['publish_time'] = parse_time(plan['publish_time']).strftime('%H:%M')
+        if plan['timezone'] is not None:
+            try:
+                ZoneInfo(plan['timezone'])
+            except ZoneInfoNotFoundError:
+                raise ValueError(f'unknown timezone {plan["timezone"]!r}')
+    else:
+        # As set_publish_time stores it: no timezone without a time
+        plan['timezone'] = None
+    plan['paused'] = plan['paused'] or 0
+    return plan
+
+def read_plans(f, fmt: str, plan_lengths: Dict[str, int]) -> Iterator[dict]:
+    """Yield the plans in an export file, raising ValueError with the line number of a bad one"""
+    if fmt == 'csv':
+        # Line 1 is the header
+        rows = enumerate(csv.DictReader(f), 2)
+    else:
+        rows = ((line, text) for line, text in enumerate(f, 1) if text.strip())
+    for line, row in rows:
+        try:
+            yield parse_plan(row if fmt == 'csv' else json.loads(row), plan_lengths)
+        except (AttributeError, TypeError, ValueError) as e:
+            raise ValueError(f'line {line}: {e}')
+
+def export_plans(args) -> int:
+    fmt = file_format(args.path, args.format)
+    out = sys.stdout if args.path == '-' else open(args.path, 'w', newline='')
+    count = 0
+    try:
+        if fmt == 'csv':
+            writer = csv.DictWriter(out, fieldnames=db.PLAN_EXPORT_COLUMNS)
+            writer.writeheader()
+            for plan in db.export_plans(args.batch_size):
+                writer.writerow(plan)
+                count += 1
+        else:
+            for plan in db.export_plans(args.batch_size):
+                out.write(json.dumps(plan) + '\n')
+                count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    print(f'Exported {count} plans', file=sys.stderr)
+    return 0
+
+def import_plans(args) -> int:
+    # Loads (and if need be compiles) the plans, so only the import needs them
+    from registry import PLANS
+    plan_lengths = {plan_type: plan.length for plan_type, plan in PLANS.items()}
+
+    fmt = file_format(args.path, args.format)
+    f = sys.stdin if args.path == '-' else open(args.path, newline='')
+    read = written = timed = 0
+    batch: List[dict] = []
+    try:
+        # One transaction per batch, so memory stays flat for any file size
+        for plan in read_plans(f, fmt, plan_lengths):
+            timed += plan['publish_time'] is not None
+            batch.append(plan)
+            if len(batch) == args.batch_size:
+                written += db.import_plans(batch, replace=args.replace)
+                read += len(batch)
+                batch = []
+        written += db.import_plans(batch, replace=args.replace)
+        read += len(batch)
+    except ValueError as e:
+        # Earlier batches are kept; rerunning without --replace skips them
+        print(f'{args.path}: {e} ({read} plans read before it, {written} written)', file=sys.stderr)
+        return 1
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    action = 'imported or replaced' if args.replace else 'imported'
+    print(f'Read {read} plans, {written} {action}, {read - written} skipped', file=sys.stderr)
+    if timed:
+        print(f'{timed} plans have their own publish time; restart a running bot to schedule them', file=sys.stderr)
+    return 0
+
+def backup_database(args) -> int:
+    if args.path:
+        size = backup.backup(args.path)
+        path = args.path
+    else:
+        path = backup.backup_and_rotate(args.dir, args.keep)
+        size = os.path.getsize(path)
+    print(f'Backed up {db.DB_PATH} to {path} ({size} bytes)', file=sys.stderr)
+    return 0
+
+def restore_database(args) -> int:
+    try:
+        backup.check(args.path)
+        # Keep what is being replaced, in case it was the wrong backup
+        previous = backup.backup_and_rotate(args.dir, keep=0)
+        backup.restore(args.path)
+    except sqlite3.Error as e:
+        print(f'{args.path}: {e}', file=sys.stderr)
+        return 1
+    print(f'Restored {db.DB_PATH} from {args.path} (it was backed up to {previous} first)', file=sys.stderr)
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Manage the bot's database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='Write every plan to a JSONL or CSV file')
+    export_parser.add_argument('path', help='File to write, or - for stdout')
+    export_parser.set_defaults(func=export_plans)
+
+    import_parser = subparsers.add_parser('import', help='Add plans from a JSONL or CSV export')
+    import_parser.add_argument('path', help='File to read, or - for stdin')
+    import_parser.add_argument('--replace', action='store_true',
+                               help="Overwrite a channel's existing plan of the same type instead of skipping it")
+    import_parser.set_defaults(func=import_plans)
+
+    for subparser in (export_parser, import_parser):
+        subparser.add_argument('--format', choices=('jsonl', 'csv'), help='File format (default by extension, else jsonl)')
+        subparser.add_argument('--batch-size', type=int, default=10000, help='Plans read or written per transaction')
+
+    backup_parser = subparsers.add_parser('backup', help='Copy the database without stopping the bot')
+    backup_parser.add_argument('path', nargs='?', help='File to write (default a timestamped file in --dir, rotated)')
+    backup_parser.add_argument('--keep', type=int, default=7, help='Number of newest backups in --dir to keep (0 keeps all)')
+    backup_parser.set_defaults(func=backup_database)
+
+    restore_parser = subparsers.add_parser('restore', help='Replace the database with a backup (stop the bot first)')
+    restore_parser.add_argument('path', help='Backup to restore')
+    restore_parser.set_defaults(func=restore_database)
+
+    for subparser in (backup_parser, restore_parser):
+        subparser.add_argument('--dir', default=backup.BACKUP_DIR, help='Directory of timestamped backups')
+
+    args = parser.parse_args()
+    return args.func(args)
+
+if __name__ == '__main__':
+    sys.exit(main())
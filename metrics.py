@@ -0,0 +1,183 @@
+"""Low-overhead counters and latency histograms, exposed in Prometheus text format.
+
+Metrics are plain in-process objects updated with a dict lookup and (for
+histograms) a bisect per observation, so they stay on in production.
+serve() answers GET /metrics on a local port for a Prometheus scraper, and
+summary() renders a short human-readable digest for the !metrics command.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from a fast SQLite read to a rate-limited send
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+METRICS: List['Metric'] = []
+
+class Metric:
+    """A named metric with one series per combination of label values."""
+    type = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series: Dict[Tuple[str, ...], object] = {}
+        METRICS.append(self)
+
+    def label_text(self, values: Tuple[str, ...], extra: str = '') -> str:
+        """Prometheus label set for a series, e.g. {command="start"}."""
+        pairs = [f'{k}="{v}"' for k, v in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.type}']
+
+class Counter(Metric):
+    """A value that only goes up."""
+    type = 'counter'
+
+    def inc(self, *labels: str, amount: float = 1.0):
+        self.series[labels] = self.series.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines.extend(f'{self.name}{self.label_text(k)} {v}' for k, v in sorted(self.series.items()))
+        return lines
+
+class Gauge(Counter):
+    """A value that is set rather than added to."""
+    type = 'gauge'
+
+    def set(self, *labels: str, value: float):
+        self.series[labels] = value
+
+class Histogram(Metric):
+    """Counts of observations per bucket, plus their sum and count."""
+    type = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            # Per-bucket counts (the last is +Inf), sum, count
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels: str):
+        """Observe the wall time of a block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def quantile(self, labels: Tuple[str, ...], q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket, as Prometheus does."""
+        counts, _, total = self.series[labels]
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return 0.0
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{self.label_text(labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self.label_text(labels)} {total}')
+            lines.append(f'{self.name}_count{self.label_text(labels)} {count}')
+        return lines
+
+COMMAND_SECONDS = Histogram('bot_command_seconds', 'Command handler latency', ('command',))
+COMMAND_ERRORS = Counter('bot_command_errors_total', 'Commands that raised an error', ('command',))
+DB_SECONDS = Histogram('bot_db_seconds', 'Database call latency', ('function',))
+DB_ERRORS = Counter('bot_db_errors_total', 'Database calls that raised an error', ('function',))
+SEND_SECONDS = Histogram('bot_send_seconds', 'Discord message send latency', ('source',))
+SEND_ERRORS = Counter('bot_send_errors_total', 'Discord sends that failed', ('source',))
+RATE_LIMITED = Counter('bot_rate_limited_total', 'Requests answered with a 429', ('scope',))
+RETRY_AFTER_SECONDS = Counter('bot_retry_after_seconds_total', 'Total retry-after time asked for by 429s', ('scope',))
+PUBLISH_RUNS = Counter('bot_publish_runs_total', 'Publish runs')
+PUBLISH_CHANNELS = Counter('bot_publish_channels_total', 'Channels published to', ('result',))
+PUBLISH_MESSAGES = Counter('bot_publish_messages_total', 'Messages sent by publish runs')
+OUTBOX_CHANNELS = Counter('bot_outbox_channels_total', 'Channels published from the outbox (hit) or rendered at publish time (miss)', ('result',))
+PUBLISH_LAST_SECONDS = Gauge('bot_publish_last_run_seconds', 'Wall time of the last publish run')
+
+def record_publish(summary):
+    """Add a publish run's PublishSummary to the totals."""
+    PUBLISH_RUNS.inc()
+    PUBLISH_CHANNELS.inc('sent', amount=summary.sent)
+    PUBLISH_CHANNELS.inc('failed', amount=summary.failed)
+    PUBLISH_CHANNELS.inc('retried', amount=summary.retried)
+    PUBLISH_MESSAGES.inc(amount=summary.messages)
+    PUBLISH_LAST_SECONDS.set(value=summary.wall_time)
+
+def record_rate_limit(retry_after: float, is_global: bool):
+    """Count a 429 and the retry-after time it asked for."""
+    scope = 'global' if is_global else 'channel'
+    RATE_LIMITED.inc(scope)
+    RETRY_AFTER_SECONDS.inc(scope, amount=retry_after)
+
+def render() -> str:
+    """Every metric in Prometheus text exposition format."""
+    return '\n'.join(line for metric in METRICS for line in metric.render()) + '\n'
+
+def summary() -> str:
+    """A short digest: count, p50 and p99 per histogram series, and every counter."""
+    lines = []
+    for metric in METRICS:
+        for labels, value in sorted(metric.series.items()):
+            name = f'{metric.name}{metric.label_text(labels)}'
+            if isinstance(metric, Histogram):
+                lines.append(f'{name} n={value[2]} p50={metric.quantile(labels, 0.5) * 1000:.1f}ms '
+                             f'p99={metric.quantile(labels, 0.99) * 1000:.1f}ms')
+            else:
+                lines.append(f'{name} {value:g}')
+    return '\n'.join(lines) or 'No metrics recorded yet'
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer one HTTP request: the metrics for GET /metrics, 404 otherwise."""
+    try:
+        request = await reader.readline()
+        # Skip the headers
+        while (await reader.readline()).strip():
+            pass
+        parts = request.split()
+        if len(parts) >= 2 and parts[0] == b'GET' and parts[1].split(b'?')[0] == b'/metrics':
+            status, body = '200 OK', render().encode()
+        else:
+            status, body = '404 Not Found', b'Not found\n'
+        writer.write(f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def serve(host: str, port: int) -> asyncio.AbstractServer:
+    """Start serving /metrics over HTTP."""
+    server = await asyncio.start_server(handle, host, port)
+    logger.info('Serving metrics on http://%s:%d/metrics', host, port)
+    return server
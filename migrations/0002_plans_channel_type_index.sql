@@ -0,0 +1,6 @@
+-- Drop duplicate plans left behind by racing !start commands, keeping the oldest
+DELETE FROM plans
+WHERE id NOT IN (SELECT MIN(id) FROM plans GROUP BY channel_id, plan_type);
+
+-- One plan of each type per channel; also serves lookups by channel_id alone
+CREATE UNIQUE INDEX IF NOT EXISTS idx_plans_channel_type ON plans (channel_id, plan_type);
@@ -0,0 +1,6 @@
+-- migrate: no-transaction
+-- page_size only takes effect after a VACUUM and must be set before leaving
+-- rollback journaling, so both happen here outside of a transaction.
+PRAGMA page_size = 4096;
+VACUUM;
+PRAGMA journal_mode = WAL;
@@ -0,0 +1,7 @@
+-- Auto-update updated_at (databases created before migrations already have it)
+CREATE TRIGGER IF NOT EXISTS update_plans_timestamp
+AFTER UPDATE ON plans
+BEGIN
+    UPDATE plans SET updated_at = CURRENT_TIMESTAMP
+    WHERE id = NEW.id;
+END;
@@ -0,0 +1,3 @@
+-- Writers set updated_at themselves so bulk updates don't fire a second
+-- UPDATE per row
+DROP TRIGGER IF EXISTS update_plans_timestamp;
@@ -0,0 +1,5 @@
+-- When each in-process schedule last ran, for catching up after downtime
+CREATE TABLE IF NOT EXISTS scheduler_runs (
+    name TEXT PRIMARY KEY,
+    last_run TEXT NOT NULL
+);
@@ -0,0 +1,4 @@
+-- Optional per-plan daily publish time (HH:MM) and IANA timezone. Plans
+-- without one are published by the global --publish/--schedule run.
+ALTER TABLE plans ADD COLUMN publish_time TEXT;
+ALTER TABLE plans ADD COLUMN timezone TEXT;
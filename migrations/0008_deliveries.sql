@@ -0,0 +1,17 @@
+-- Journal of daily publishes. A row is written in the same transaction that
+-- advances its plan, holding the day being published, and records how many
+-- of its messages have been sent so an interrupted run can resume.
+CREATE TABLE IF NOT EXISTS deliveries (
+    plan_id INTEGER NOT NULL,
+    publish_date TEXT NOT NULL,
+    channel_id INTEGER NOT NULL,
+    plan_type TEXT NOT NULL,
+    current_day INTEGER NOT NULL,
+    paused BOOLEAN NOT NULL,
+    sent INTEGER NOT NULL DEFAULT 0,
+    completed_at TIMESTAMP,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (plan_id, publish_date)
+);
+
+CREATE INDEX IF NOT EXISTS idx_deliveries_pending ON deliveries (publish_date) WHERE completed_at IS NULL;
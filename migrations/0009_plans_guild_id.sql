@@ -0,0 +1,4 @@
+-- Guild of each plan's channel, so a sharded bot can tell which shard owns a
+-- plan. 0 for channels outside a guild (DMs) or that no longer exist; NULL
+-- until the bot looks it up for plans created before this column existed.
+ALTER TABLE plans ADD COLUMN guild_id INTEGER;
@@ -0,0 +1,8 @@
+-- Leases for publish workers. A worker claims a channel's pending deliveries
+-- until lease_expires (unix time); after that a crashed worker's deliveries
+-- can be claimed again, up to a limit on attempts.
+ALTER TABLE deliveries ADD COLUMN leased_by TEXT;
+ALTER TABLE deliveries ADD COLUMN lease_expires REAL;
+ALTER TABLE deliveries ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS idx_deliveries_queue ON deliveries (channel_id) WHERE completed_at IS NULL;
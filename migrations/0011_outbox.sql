@@ -0,0 +1,9 @@
+-- Each channel's messages for its next default publish, rendered and packed
+-- ahead of time. state records the plans, days and plan file versions they
+-- were rendered from, so a publish only sends them if nothing has changed.
+CREATE TABLE IF NOT EXISTS outbox (
+    channel_id INTEGER PRIMARY KEY,
+    state TEXT NOT NULL,
+    messages TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,2 @@
+-- Lets prune_deliveries find old journal rows without reading the whole table.
+CREATE INDEX IF NOT EXISTS idx_deliveries_created ON deliveries (created_at);
@@ -0,0 +1,211 @@
+"""Compiled, memory-mapped reading plan files.
+
+A compiled plan (.plan) is laid out as:
+
+    magic        8 bytes, b'MBRPLAN1'
+    header_len   uint32 little endian
+    day_count    uint32 little endian
+    header       header_len bytes of UTF-8 JSON (name, type, source_link, length,
+                 hash, per-day byte and word counts, ...)
+    offsets      day_count + 1 uint64 little endian offsets into the payload
+    payload      each day's readings as a UTF-8 JSON list of strings
+
+Opening a plan only parses the header; a day's readings are decoded from
+the mapped payload when they are asked for.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import tempfile
+from typing import List, Optional
+
+MAGIC = b'MBRPLAN1'
+# Bumped whenever the header contents change so old artifacts are rebuilt
+FORMAT_VERSION = 2
+PREFIX = struct.Struct('<8sII')
+OFFSET = struct.Struct('<Q')
+
+# Discord's per-message character limit
+MESSAGE_LIMIT = 2000
+
+# Where JSON plans are read from and compiled plans are written to
+PLANS_DIR = 'plans'
+COMPILED_DIR = os.path.join('build', 'plans')
+
+PLAN_TYPES = ('bible_calendar', 'book')
+PLAN_KEYS = ('name', 'type', 'source_link', 'readings')
+
+class PlanError(ValueError):
+    """Raised when a plan file fails validation."""
+
+class PlanFile:
+    """A read-only, memory-mapped compiled plan."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, header_len, day_count = PREFIX.unpack_from(self._map, 0)
+            if magic != MAGIC:
+                raise ValueError(f'{path} is not a compiled plan file')
+            self.header = json.loads(self._map[PREFIX.size:PREFIX.size + header_len])
+        except (ValueError, struct.error):
+            self._map.close()
+            raise
+        self._offsets_at = PREFIX.size + header_len
+        self._payload_at = self._offsets_at + (day_count + 1) * OFFSET.size
+        self.length = day_count
+
+    @property
+    def name(self) -> str:
+        return self.header['name']
+
+    @property
+    def type(self) -> str:
+        return self.header['type']
+
+    @property
+    def source_link(self) -> Optional[str]:
+        return self.header.get('source_link')
+
+    @property
+    def hash(self) -> str:
+        return self.header['hash']
+
+    def day(self, index: int) -> List[str]:
+        """Decode the readings for a 0-based day."""
+        if not 0 <= index < self.length:
+            raise IndexError(f'day {index} out of range for {self.length}-day plan')
+        start, = OFFSET.unpack_from(self._map, self._offsets_at + index * OFFSET.size)
+        end, = OFFSET.unpack_from(self._map, self._offsets_at + (index + 1) * OFFSET.size)
+        return json.loads(self._map[self._payload_at + start:self._payload_at + end])
+
+    def close(self):
+        self._map.close()
+
+def write_plan_file(path: str, plan: dict, header: dict):
+    """Write a plan dict as a compiled plan file, replacing any existing file atomically."""
+    days = [json.dumps(readings, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            for readings in plan['readings']]
+    header_bytes = json.dumps(header, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    offsets = [0]
+    for day in days:
+        offsets.append(offsets[-1] + len(day))
+
+    # A temp file of its own, since shard processes may compile the same plan at once
+    fd, tmp_path = tempfile.mkstemp(prefix=f'{os.path.basename(path)}.', suffix='.tmp',
+                                    dir=os.path.dirname(path) or '.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(PREFIX.pack(MAGIC, len(header_bytes), len(days)))
+            f.write(header_bytes)
+            f.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+            f.write(b''.join(days))
+        # mkstemp creates the file readable by its owner only
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+def check_plan(plan) -> List[str]:
+    """Validate a parsed JSON plan, returning a list of problems (empty if valid)."""
+    if not isinstance(plan, dict):
+        return ['plan must be a JSON object']
+
+    errors = []
+    for key in plan:
+        if key not in PLAN_KEYS:
+            errors.append(f'unknown key {key!r}')
+    if not isinstance(plan.get('name'), str) or not plan.get('name', '').strip():
+        errors.append("'name' must be a non-empty string")
+    if plan.get('type') not in PLAN_TYPES:
+        errors.append(f"'type' must be one of {', '.join(PLAN_TYPES)}")
+    if 'source_link' in plan and not (isinstance(plan['source_link'], str)
+                                      and plan['source_link'].startswith(('http://', 'https://'))):
+        errors.append("'source_link' must be an http(s) URL")
+
+    readings = plan.get('readings')
+    if not isinstance(readings, list) or not readings:
+        errors.append("'readings' must be a non-empty list of days")
+        return errors
+
+    # Longest header a bible_calendar day can be sent with, around its readings
+    name = plan.get('name', '')
+    header_length = len(f'[{name}]({plan.get("source_link", "")}), Daily Reading {len(readings)} (Paused) -- ****')
+    for day, day_readings in enumerate(readings, 1):
+        if not isinstance(day_readings, list) or not day_readings:
+            errors.append(f'day {day}: must be a non-empty list of readings')
+            continue
+        if not all(isinstance(r, str) and r.strip() for r in day_readings):
+            errors.append(f'day {day}: readings must be non-empty strings')
+            continue
+
+        if plan.get('type') == 'bible_calendar':
+            if header_length + len(', '.join(day_readings)) > MESSAGE_LIMIT:
+                errors.append(f'day {day}: readings do not fit in one {MESSAGE_LIMIT}-char message')
+        else:
+            # The chunker would have to cut such a word in half
+            for word in (w for r in day_readings for w in r.split()):
+                if len(word) > MESSAGE_LIMIT:
+                    errors.append(f'day {day}: word of {len(word)} chars exceeds {MESSAGE_LIMIT}-char message limit')
+                    break
+    return errors
+
+def normalize_plan(plan: dict) -> dict:
+    """Return a copy of a valid plan with stray BOMs and surrounding whitespace removed."""
+    normalized = {
+        'name': plan['name'].strip(),
+        'type': plan['type'],
+        'readings': [[r.replace('\ufeff', '').strip() for r in day] for day in plan['readings']],
+    }
+    if 'source_link' in plan:
+        normalized['source_link'] = plan['source_link'].strip()
+    return normalized
+
+def compile_plan(source_path: str, path: str) -> dict:
+    """Validate and compile a JSON plan file into a plan file at `path`, returning its header.
+
+    Raises PlanError if the plan is invalid.
+    """
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    try:
+        plan = json.loads(data)
+    except ValueError as e:
+        raise PlanError(f'{source_path}: invalid JSON: {e}') from e
+
+    errors = check_plan(plan)
+    if errors:
+        raise PlanError(f'{source_path}: ' + '; '.join(errors))
+    plan = normalize_plan(plan)
+    stat = os.stat(source_path)
+
+    header = {
+        'format': FORMAT_VERSION,
+        'name': plan['name'],
+        'type': plan['type'],
+        'length': len(plan['readings']),
+        'hash': hashlib.sha256(data).hexdigest(),
+        # Lets loaders spot a stale artifact from a stat() alone
+        'source_mtime_ns': stat.st_mtime_ns,
+        'source_size': stat.st_size,
+        'day_bytes': [sum(len(r.encode('utf-8')) for r in day) for day in plan['readings']],
+        'day_words': [sum(len(r.split()) for r in day) for day in plan['readings']],
+    }
+    if 'source_link' in plan:
+        header['source_link'] = plan['source_link']
+    write_plan_file(path, plan, header)
+    return header
+
+def is_stale(source_path: str, plan_file: PlanFile) -> bool:
+    """Check whether a compiled plan is out of date with its JSON source."""
+    stat = os.stat(source_path)
+    return (plan_file.header.get('format') != FORMAT_VERSION
+            or plan_file.header.get('source_mtime_ns') != stat.st_mtime_ns
+            or plan_file.header.get('source_size') != stat.st_size)
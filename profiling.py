@@ -0,0 +1,107 @@
+"""Per-stage timings and cProfile helpers for finding where time goes.
+
+Stages (startup phases, each publish step, each plan type's rendering) are
+always timed: a stage costs two clock reads, so the breakdown is available
+for any run. Wall time is elapsed time; CPU time is the whole process's, so
+a stage that awaits also counts CPU used meanwhile by other tasks and the
+database thread. Database time per function comes from metrics.DB_SECONDS.
+
+cProfile is only switched on for --profile runs or an owner's !profile
+sample, and only sees the event loop thread.
+
+memory_usage() reports the process's resident set size for the !memory command.
+"""
+import atexit
+import cProfile
+import io
+import os
+import pstats
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
+import metrics
+
+class Stages:
+    """Count, wall time and CPU time totals per named stage."""
+
+    def __init__(self):
+        self.totals: Dict[str, List[float]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """Time a block as (one run of) a stage."""
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - wall, time.process_time() - cpu)
+
+    def add(self, name: str, wall: float, cpu: float):
+        totals = self.totals.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += 1
+        totals[1] += wall
+        totals[2] += cpu
+
+    def clear(self):
+        self.totals.clear()
+
+    def report(self) -> str:
+        """The stages in order of first use, then database time per function."""
+        lines = [f'{"stage":<40} {"count":>7} {"wall s":>9} {"cpu s":>9}']
+        lines.extend(f'{name:<40} {count:>7} {wall:>9.3f} {cpu:>9.3f}' for name, (count, wall, cpu) in self.totals.items())
+        db_series = sorted(metrics.DB_SECONDS.series.items(), key=lambda item: -item[1][1])
+        if db_series:
+            lines.append('')
+            lines.append(f'{"database (incl. queueing)":<40} {"calls":>7} {"wall s":>9}')
+            lines.extend(f'{labels[0]:<40} {count:>7} {total:>9.3f}' for labels, (_, total, count) in db_series)
+        return '\n'.join(lines)
+
+STAGES = Stages()
+stage = STAGES.stage
+
+def profile_stats(profile: cProfile.Profile, limit: int = 25) -> str:
+    """The top functions of a profile by cumulative time, as pstats prints them."""
+    out = io.StringIO()
+    pstats.Stats(profile, stream=out).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(limit)
+    return out.getvalue()
+
+def dump(profile: cProfile.Profile, path: str):
+    """Write a profile to `path` (for pstats or snakeviz) and the stage breakdown to `path`.txt."""
+    profile.dump_stats(path)
+    with open(f'{path}.txt', 'w') as f:
+        f.write(STAGES.report())
+        f.write('\n\n')
+        f.write(profile_stats(profile))
+
+def start(path: str) -> cProfile.Profile:
+    """Profile the rest of the process and dump it (see dump) to `path` at exit.
+
+    {pid} in the path is replaced with the process ID, so several processes
+    (shards, publish workers) can share one --profile argument.
+    """
+    profile = cProfile.Profile()
+
+    def finish():
+        profile.disable()
+        dump(profile, path.format(pid=os.getpid()))
+
+    atexit.register(finish)
+    profile.enable()
+    return profile
+
+def memory_usage() -> Tuple[int, int]:
+    """The process's current and peak resident set size in bytes.
+
+    The current size is read from /proc, so elsewhere than Linux it is
+    reported as the peak.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kB on Linux, bytes on macOS
+    peak = peak if sys.platform == 'darwin' else peak * 1024
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize(), peak
+    except OSError:
+        return peak, peak
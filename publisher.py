@@ -0,0 +1,198 @@
+"""Concurrent fan-out of message payloads to many channels.
+
+Channels are sent to in parallel up to a concurrency limit while each
+channel's own messages go out strictly in order. Sends are paced with
+token buckets (one per channel plus one global) that mirror Discord's
+rate limits, so the API is kept busy without tripping 429s.
+"""
+import asyncio
+import logging
+import time
+import metrics
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Discord allows roughly 5 messages per 5 seconds per channel and 50 requests
+# per second per bot overall
+CHANNEL_RATE = (5, 5.0)
+GLOBAL_RATE = (50, 1.0)
+
+OnSent = Callable[[int], Awaitable[None]]
+
+@dataclass
+class PublishSummary:
+    """Outcome of one publish run."""
+    sent: int = 0
+    failed: int = 0
+    retried: int = 0
+    messages: int = 0
+    retries: int = 0
+    wall_time: float = 0.0
+
+    def add(self, other: 'PublishSummary'):
+        """Add another run's counts and time to this one."""
+        self.sent += other.sent
+        self.failed += other.failed
+        self.retried += other.retried
+        self.messages += other.messages
+        self.retries += other.retries
+        self.wall_time += other.wall_time
+
+    def __str__(self) -> str:
+        return (f'{self.sent} channels sent, {self.failed} failed, {self.retried} retried '
+                f'({self.messages} messages, {self.retries} retries) in {self.wall_time:.2f}s')
+
+class RateLimitBucket:
+    """Token bucket allowing `rate` sends every `per` seconds."""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until a send is allowed and take a token for it."""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+
+                self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+    def block(self, delay: float):
+        """Hold all sends through this bucket for `delay` seconds (e.g. after a 429)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+def parse_rate_limit(headers) -> Tuple[float, bool]:
+    """Return (retry_after, is_global) from the headers of a 429 response."""
+    is_global = headers.get('X-RateLimit-Global', '').lower() == 'true' or headers.get('X-RateLimit-Scope') == 'global'
+    return float(headers.get('Retry-After', 1.0)), is_global
+
+def get_retry_after(exc: Exception) -> Optional[Tuple[float, bool]]:
+    """Return (retry_after, is_global) if exc is a rate-limit error, otherwise None."""
+    if getattr(exc, 'status', None) != 429 and not hasattr(exc, 'retry_after'):
+        return None
+
+    headers = getattr(getattr(exc, 'response', None), 'headers', None) or {}
+    retry_after, is_global = parse_rate_limit(headers)
+    return float(getattr(exc, 'retry_after', None) or retry_after), is_global
+
+async def send_payload(channel, payload: dict):
+    """Default transport: pass the payload straight to channel.send."""
+    await channel.send(**payload)
+
+class Publisher:
+    """Sends message payloads to many channels with bounded concurrency."""
+
+    def __init__(self, concurrency: int = 10,
+                 send: Callable[[object, dict], Awaitable[None]] = send_payload,
+                 max_retries: int = 3,
+                 channel_rate: Tuple[int, float] = None,
+                 global_rate: Tuple[int, float] = None):
+        self.concurrency = concurrency
+        self.send = send
+        self.max_retries = max_retries
+        self.channel_rate = channel_rate or CHANNEL_RATE
+        self.global_bucket = RateLimitBucket(*(global_rate or GLOBAL_RATE))
+        self.channel_buckets: Dict[int, RateLimitBucket] = {}
+
+    def get_bucket(self, channel_id: int) -> RateLimitBucket:
+        """Get the rate-limit bucket for a channel, creating it on first use."""
+        bucket = self.channel_buckets.get(channel_id)
+        if bucket is None:
+            bucket = self.channel_buckets[channel_id] = RateLimitBucket(*self.channel_rate)
+        return bucket
+
+    async def publish(self, jobs: Iterable[Tuple], summary: PublishSummary = None) -> PublishSummary:
+        """Send each job's payloads to its channel and return a summary of the run.
+
+        A job is (channel, payloads) or (channel, payloads, on_sent). on_sent is
+        awaited after each of the job's payloads is delivered, with the number of
+        that job's payloads delivered so far. Jobs for the same channel are
+        merged, keeping their order. Counts go into `summary` if given, e.g. one
+        that already holds channels that failed before sending.
+        """
+        start = time.perf_counter()
+        summary = summary or PublishSummary()
+
+        # Group by channel so one worker owns each channel and keeps it in order
+        grouped: Dict[object, Tuple[object, List[Tuple[dict, Optional[OnSent], int]]]] = {}
+        for index, (channel, payloads, *on_sent) in enumerate(jobs):
+            on_sent = on_sent[0] if on_sent else None
+            # Unknown channels (None) can't be told apart, so each job counts as its own failure
+            key = getattr(channel, 'id', id(channel)) if channel is not None else (None, index)
+            if key not in grouped:
+                grouped[key] = (channel, [])
+            grouped[key][1].extend((payload, on_sent, n) for n, payload in enumerate(payloads, 1))
+
+        queue = asyncio.Queue()
+        for item in grouped.values():
+            queue.put_nowait(item)
+
+        async def worker():
+            while not queue.empty():
+                channel, payloads = queue.get_nowait()
+                await self.publish_channel(channel, payloads, summary)
+
+        workers = min(self.concurrency, queue.qsize())
+        await asyncio.gather(*(worker() for _ in range(workers)))
+
+        summary.wall_time = time.perf_counter() - start
+        metrics.record_publish(summary)
+        return summary
+
+    async def publish_channel(self, channel, payloads: List[Tuple[dict, Optional[OnSent], int]],
+                              summary: PublishSummary) -> bool:
+        """Send payloads to one channel in order, stopping at the first hard failure."""
+        if channel is None:
+            logger.warning('Skipping %d messages for an unknown channel', len(payloads))
+            summary.failed += 1
+            return False
+
+        bucket = self.get_bucket(channel.id)
+        retried = False
+        for payload, on_sent, n in payloads:
+            attempts = 0
+            while True:
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                try:
+                    with metrics.SEND_SECONDS.time('publish'):
+                        await self.send(channel, payload)
+                except Exception as exc:
+                    rate_limit = get_retry_after(exc)
+                    if rate_limit is None or attempts >= self.max_retries:
+                        logger.warning('Failed to publish to channel %s: %s', channel.id, exc)
+                        metrics.SEND_ERRORS.inc('publish')
+                        summary.failed += 1
+                        return False
+
+                    # Counted in metrics by whatever saw the 429 (see metrics.record_rate_limit)
+                    retry_after, is_global = rate_limit
+                    (self.global_bucket if is_global else bucket).block(retry_after)
+                    attempts += 1
+                    retried = True
+                    summary.retries += 1
+                    continue
+
+                summary.messages += 1
+                if on_sent is not None:
+                    await on_sent(n)
+                break
+
+        summary.sent += 1
+        if retried:
+            summary.retried += 1
+        return True
@@ -0,0 +1,90 @@
+"""Reading plans loaded from the plans/ directory.
+
+Each plans/<type>.json is compiled once into build/plans/<type>.plan (see
+plan_store.py and compile_plans.py) and memory-mapped from there, so
+startup only reads plan headers and a day's readings are decoded when they
+are requested. An artifact missing or older than its JSON source is
+compiled on load; an invalid plan raises PlanError. compile_changed_plans()
+and swap_plans() pick up edits while the bot is running.
+"""
+import logging
+import os
+import struct
+from typing import Dict, List
+from plan_store import COMPILED_DIR, PLANS_DIR, PlanFile, compile_plan, is_stale
+
+logger = logging.getLogger(__name__)
+
+# plan_type -> compiled plan, and plan_type -> sha256 of the plan's JSON file
+PLANS = {}
+PLAN_HASHES = {}
+
+def load_plan(plan_type: str) -> PlanFile:
+    """Open the compiled plan for a type, compiling it first if missing or stale."""
+    source_path = os.path.join(PLANS_DIR, f'{plan_type}.json')
+    path = os.path.join(COMPILED_DIR, f'{plan_type}.plan')
+    if os.path.exists(path):
+        try:
+            plan = PlanFile(path)
+        except (ValueError, struct.error) as e:
+            # Damaged, e.g. by an older version's racing compiles; rebuild it
+            logger.warning('Recompiling unreadable plan %s: %s', path, e)
+        else:
+            if not is_stale(source_path, plan):
+                return plan
+            plan.close()
+
+    compile_plan(source_path, path)
+    return PlanFile(path)
+
+def load_plans():
+    """Load every plan in PLANS_DIR."""
+    os.makedirs(COMPILED_DIR, exist_ok=True)
+    for p in sorted(os.listdir(PLANS_DIR)):
+        if not p.endswith('.json'):
+            continue
+        plan_type = os.path.splitext(p)[0]
+        PLANS[plan_type] = load_plan(plan_type)
+        PLAN_HASHES[plan_type] = PLANS[plan_type].hash
+
+def compile_changed_plans() -> Dict[str, PlanFile]:
+    """Open (recompiling as needed) every plan whose JSON changed since it was loaded.
+
+    Safe to run in a worker thread: it only reads PLANS. Pass the result to
+    swap_plans on the thread that uses the plans. A plan that fails
+    validation is left out, so its previous version stays in use until it
+    is fixed.
+    """
+    plans = {}
+    for p in sorted(os.listdir(PLANS_DIR)):
+        if not p.endswith('.json'):
+            continue
+        plan_type = os.path.splitext(p)[0]
+        current = PLANS.get(plan_type)
+        try:
+            if current is not None and not is_stale(os.path.join(PLANS_DIR, p), current):
+                continue
+            plans[plan_type] = load_plan(plan_type)
+        except (OSError, ValueError, struct.error) as e:
+            # ValueError includes PlanError
+            logger.warning('Not reloading plan %s: %s', plan_type, e)
+    return plans
+
+def swap_plans(plans: Dict[str, PlanFile]) -> List[str]:
+    """Put plans from compile_changed_plans in place of the old versions, returning their types.
+
+    Call this from the thread that reads PLANS (the event loop), between
+    reads, so nothing iterating PLANS sees it change and no render is still
+    using a replaced plan when it is unmapped. Deleted files stay loaded so
+    running plans keep working.
+    """
+    for plan_type, plan in plans.items():
+        current = PLANS.get(plan_type)
+        PLANS[plan_type] = plan
+        PLAN_HASHES[plan_type] = plan.hash
+        if current is not None:
+            current.close()
+    return list(plans)
+
+# Load the plans when the module is imported
+load_plans()
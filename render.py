@@ -0,0 +1,140 @@
+"""Message rendering for reading plans, memoized per plan content.
+
+Payloads are channel.send() keyword arguments, with embeds as plain dicts
+(see discord.Embed.from_dict) so they stay serializable. Rendered payloads
+are cached with bounded LRU eviction. Cache keys include
+the content hash of the plan file, so editing a plan can never serve stale
+text. Callers must treat the returned payloads as read-only.
+"""
+import functools
+from typing import List, Sequence, Tuple
+from chunker import iter_chunks
+from plan_store import MESSAGE_LIMIT, PlanFile
+from registry import PLANS, PLAN_HASHES
+
+# Enough for every day of several plans in both paused states
+CACHE_SIZE = 4096
+
+# Placed between pieces of text packed into one message
+PACK_SEPARATOR = '\n\n'
+
+# Discord's embed limits: description length, combined text per message, embeds per message
+EMBED_DESCRIPTION_LIMIT = 4096
+EMBED_TOTAL_LIMIT = 6000
+EMBEDS_PER_MESSAGE = 10
+
+def format_plan_name(plan_content: PlanFile) -> str:
+    """Format plan name with source link if available"""
+    name = plan_content.name
+    return f'[{name}]({plan_content.source_link})' if plan_content.source_link else name
+
+def render_book_embeds(reading_header: str, readings: List[str]) -> List[dict]:
+    """Pack a book day's paragraphs into embed descriptions, several embeds per message
+
+    The header goes in the first message's content. A paragraph too long for one
+    embed description falls back to plain chunked messages.
+    """
+    payloads = [{'content': f'**{reading_header}**', 'embeds': []}]
+    for reading in readings:
+        if len(reading) > EMBED_DESCRIPTION_LIMIT:
+            payloads.extend({'content': chunk} for chunk in iter_chunks([reading]))
+            continue
+
+        embeds = payloads[-1].get('embeds')
+        used = sum(len(e['description']) for e in embeds) if embeds is not None else 0
+        if embeds and len(embeds[-1]['description']) + len(PACK_SEPARATOR) + len(reading) <= EMBED_DESCRIPTION_LIMIT \
+                and used + len(PACK_SEPARATOR) + len(reading) <= EMBED_TOTAL_LIMIT:
+            embeds[-1]['description'] += PACK_SEPARATOR + reading
+        elif embeds is not None and len(embeds) < EMBEDS_PER_MESSAGE and used + len(reading) <= EMBED_TOTAL_LIMIT:
+            embeds.append({'description': reading})
+        else:
+            payloads.append({'embeds': [{'description': reading}]})
+    return payloads
+
+@functools.lru_cache(maxsize=CACHE_SIZE)
+def _render_daily_reading(plan_type: str, plan_hash: str, day: int, paused: bool, embeds: bool) -> Tuple[dict, ...]:
+    # plan_hash is only part of the cache key, so an edited plan file misses the cache
+    plan_content = PLANS[plan_type]
+    paused_text = " (Paused)" if paused else ""
+
+    reading_header = f'{format_plan_name(plan_content)}, Daily Reading {day + 1}{paused_text} --'
+    readings = plan_content.day(day)
+
+    p_type = plan_content.type
+    if p_type == 'bible_calendar':
+        return ({'content': f'{reading_header} **{", ".join(readings)}**'},)
+    elif p_type == 'book' and embeds:
+        return tuple(render_book_embeds(reading_header, readings))
+    elif p_type == 'book':
+        payloads = [{'content': f'**{reading_header}**'}]
+        payloads.extend({'content': chunk} for chunk in iter_chunks(readings))
+        return tuple(payloads)
+    else:
+        return ({'content': f'Unsupported plan type: {p_type}'},)
+
+def render_daily_reading(plan: dict, embeds: bool = False) -> Tuple[dict, ...]:
+    """Get the message payloads for a plan's daily reading, in send order
+
+    With embeds, book readings are packed into embeds instead of 2000-char messages.
+    """
+    plan_type = plan["plan_type"]
+    return _render_daily_reading(plan_type, PLAN_HASHES[plan_type], plan["current_day"], bool(plan["paused"]), embeds)
+
+def pack_payloads(parts: Sequence[Sequence[dict]], limit: int = MESSAGE_LIMIT) -> List[Tuple[dict, List[Tuple[int, int]]]]:
+    """Pack several lists of payloads bound for one channel into as few messages as possible.
+
+    Consecutive text-only payloads are joined while they fit within `limit`;
+    anything else (e.g. embeds) is sent on its own. Order is preserved. Each
+    packed payload comes with a (part index, count) pair for every part it
+    carries, where count is how many of that part's payloads have been
+    delivered once this message is sent.
+    """
+    packed = []
+    for index, payloads in enumerate(parts):
+        for count, payload in enumerate(payloads, 1):
+            if packed and payload.keys() == {'content'} and packed[-1][0].keys() == {'content'} \
+                    and len(packed[-1][0]['content']) + len(PACK_SEPARATOR) + len(payload['content']) <= limit:
+                previous, progress = packed[-1]
+                packed[-1] = ({'content': previous['content'] + PACK_SEPARATOR + payload['content']}, progress)
+            else:
+                packed.append((dict(payload), []))
+
+            progress = packed[-1][1]
+            if progress and progress[-1][0] == index:
+                progress[-1] = (index, count)
+            else:
+                progress.append((index, count))
+    return packed
+
+@functools.lru_cache(maxsize=8)
+def _render_plan_list(plan_hashes: tuple, prefix: str) -> str:
+    message = f'No reading plans found. Try adding one with {prefix}start <type> from the following list:\n'
+    for plan_type, plan_content in PLANS.items():
+        message += f'- `{plan_type}` ({format_plan_name(plan_content)})\n'
+    return message
+
+def render_plan_list(prefix: str = '/') -> str:
+    """Get the message listing every available plan, for channels without any, with commands shown using `prefix`"""
+    return _render_plan_list(tuple(PLAN_HASHES.items()), prefix)
+
+@functools.lru_cache(maxsize=8)
+def _render_help_plans(plan_hashes: tuple) -> str:
+    plans_text = ""
+    for plan_type, plan_content in PLANS.items():
+        source_link = f" ([source]({plan_content.source_link}))" if plan_content.source_link else ""
+        plans_text += f"• `{plan_type}` - {plan_content.name}{source_link}\n"
+    return plans_text
+
+def render_help_plans() -> str:
+    """Get the available plans field of the help embed"""
+    return _render_help_plans(tuple(PLAN_HASHES.items()))
+
+def clear_cache():
+    """Drop every memoized render"""
+    _render_daily_reading.cache_clear()
+    _render_plan_list.cache_clear()
+    _render_help_plans.cache_clear()
+
+def cache_info():
+    """Hits, misses and size of the memoized daily readings"""
+    return _render_daily_reading.cache_info()
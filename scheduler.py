@@ -0,0 +1,226 @@
+"""In-process daily scheduling for the publish routine.
+
+DailyScheduler fires a callback at fixed local times each day inside the
+running bot, replacing a cron-launched --publish process. The last run is
+persisted, so slots missed while the bot was down are caught up on start.
+PlanTimers keeps a min-heap of per-plan publish times in each plan's own
+timezone and only wakes for the next one due.
+
+All time handling goes through a Clock, which FakeClock replaces to drive
+the schedulers offline.
+"""
+import asyncio
+import heapq
+import logging
+import random
+from datetime import datetime, time, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on a single sleep, so clock changes and suspends are noticed
+MAX_SLEEP = 60.0
+
+class Clock:
+    """The real wall clock."""
+
+    def now(self) -> datetime:
+        return datetime.now().astimezone()
+
+    async def sleep(self, seconds: float, wake: asyncio.Event = None):
+        """Sleep for a while, returning early if `wake` is set."""
+        if wake is None:
+            await asyncio.sleep(seconds)
+            return
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+class FakeClock(Clock):
+    """A clock that only moves when slept on or advanced, for offline tests."""
+
+    def __init__(self, start: datetime):
+        self.current = start
+
+    def now(self) -> datetime:
+        return self.current
+
+    async def sleep(self, seconds: float, wake: asyncio.Event = None):
+        self.current += timedelta(seconds=seconds)
+        await asyncio.sleep(0)
+
+    def advance(self, seconds: float):
+        self.current += timedelta(seconds=seconds)
+
+def parse_times(value: str) -> List[time]:
+    """Parse a comma-separated list of HH:MM times, e.g. '06:00,18:30'."""
+    return sorted(datetime.strptime(t.strip(), '%H:%M').time() for t in value.split(','))
+
+class DailyScheduler:
+    """Runs a callback at the given local times every day."""
+
+    def __init__(self, times: List[time], callback: Callable[[datetime], Awaitable[None]],
+                 load_last_run: Callable[[], Awaitable[Optional[datetime]]],
+                 save_last_run: Callable[[datetime], Awaitable[None]],
+                 clock: Clock = None, max_catch_up: int = 1):
+        self.times = sorted(times)
+        self.callback = callback
+        self.load_last_run = load_last_run
+        self.save_last_run = save_last_run
+        self.clock = clock or Clock()
+        self.max_catch_up = max_catch_up
+
+    def slot(self, day, at: time) -> datetime:
+        """The local datetime for a time of day on a date."""
+        return datetime.combine(day, at).astimezone()
+
+    def slots_between(self, start: datetime, end: datetime) -> List[datetime]:
+        """Every slot after start, up to and including end."""
+        slots = []
+        day = start.date()
+        while day <= end.date():
+            slots.extend(s for s in (self.slot(day, t) for t in self.times) if start < s <= end)
+            day += timedelta(days=1)
+        return slots
+
+    def next_slot(self, after: datetime) -> datetime:
+        """The first slot strictly after a moment."""
+        day = after.date()
+        while True:
+            for t in self.times:
+                slot = self.slot(day, t)
+                if slot > after:
+                    return slot
+            day += timedelta(days=1)
+
+    async def run_due(self, last_run: Optional[datetime]) -> datetime:
+        """Fire every slot due since last_run (up to max_catch_up) and return the new last run."""
+        now = self.clock.now()
+        if last_run is None:
+            # First start: nothing to catch up on
+            await self.save_last_run(now)
+            return now
+
+        missed = self.slots_between(last_run, now)
+        if not missed:
+            return last_run
+        if len(missed) > self.max_catch_up:
+            logger.warning('Skipping %d missed runs, catching up on the last %d',
+                           len(missed) - self.max_catch_up, self.max_catch_up)
+
+        to_run = missed[-self.max_catch_up:] if self.max_catch_up > 0 else []
+        for slot in to_run:
+            try:
+                await self.callback(slot)
+            except Exception:
+                logger.exception('Scheduled run for %s failed', slot)
+            # Recorded per slot so a crash mid catch-up doesn't repeat finished runs
+            await self.save_last_run(slot)
+        await self.save_last_run(missed[-1])
+        return missed[-1]
+
+    async def run_forever(self):
+        """Fire slots as they come due, sleeping in between."""
+        last_run = await self.run_due(await self.load_last_run())
+        while True:
+            now = self.clock.now()
+            delay = (self.next_slot(now) - now).total_seconds()
+            await self.clock.sleep(min(max(delay, 0), MAX_SLEEP))
+            last_run = await self.run_due(last_run)
+
+def parse_time(value: str) -> time:
+    """Parse a single HH:MM time."""
+    return datetime.strptime(value.strip(), '%H:%M').time()
+
+def next_fire(at: time, timezone: Optional[str], after: datetime) -> datetime:
+    """The first time-of-day `at` in a timezone (local if None) strictly after a moment."""
+    tz = ZoneInfo(timezone) if timezone else None
+    local_after = after.astimezone(tz)
+    day = local_after.date()
+    while True:
+        if tz:
+            fire = datetime.combine(day, at, tzinfo=tz)
+        else:
+            fire = datetime.combine(day, at).astimezone()
+        if fire > after:
+            return fire
+        day += timedelta(days=1)
+
+class PlanTimers:
+    """Min-heap of the next publish time of every plan with its own schedule.
+
+    Scheduling and firing a plan cost O(log n). Rescheduled or cancelled
+    plans leave stale heap entries behind, which are skipped when popped.
+    Each plan gets a stable random offset of up to `jitter` seconds so plans
+    sharing a time don't all fire in the same instant.
+    """
+
+    def __init__(self, clock: Clock = None, jitter: float = 0.0):
+        self.clock = clock or Clock()
+        self.jitter = jitter
+        # (fire timestamp, plan_id, generation, local date of the unjittered fire)
+        self.heap: List[Tuple[float, int, int, str]] = []
+        # plan_id -> (publish time, timezone, generation of its live heap entry)
+        self.plans: Dict[int, Tuple[time, Optional[str], int]] = {}
+        self.generation = 0
+        self.changed = asyncio.Event()
+
+    def offset(self, plan_id: int) -> timedelta:
+        """The plan's fixed jitter offset."""
+        return timedelta(seconds=random.Random(plan_id).uniform(0, self.jitter)) if self.jitter else timedelta()
+
+    def schedule(self, plan_id: int, at: time, timezone: Optional[str] = None, after: datetime = None):
+        """Set (or replace) a plan's daily publish time."""
+        after = after or self.clock.now()
+        self.generation += 1
+        self.plans[plan_id] = (at, timezone, self.generation)
+        fire_at = next_fire(at, timezone, after - self.offset(plan_id))
+        entry = ((fire_at + self.offset(plan_id)).timestamp(), plan_id, self.generation, fire_at.date().isoformat())
+        heapq.heappush(self.heap, entry)
+        self.changed.set()
+
+    def cancel(self, plan_id: int):
+        """Stop publishing a plan on its own schedule."""
+        self.plans.pop(plan_id, None)
+
+    def next_fire_at(self) -> Optional[float]:
+        """Timestamp of the next live timer, discarding stale entries on top."""
+        while self.heap:
+            fire_at, plan_id, generation, _ = self.heap[0]
+            entry = self.plans.get(plan_id)
+            if entry is not None and entry[2] == generation:
+                return fire_at
+            heapq.heappop(self.heap)
+        return None
+
+    def pop_due(self) -> List[Tuple[int, str]]:
+        """Pop every plan due by now as (plan_id, local publish date) and schedule its next day."""
+        now = self.clock.now()
+        due = []
+        while True:
+            fire_at = self.next_fire_at()
+            if fire_at is None or fire_at > now.timestamp():
+                return due
+            _, plan_id, _, publish_date = heapq.heappop(self.heap)
+            due.append((plan_id, publish_date))
+            at, timezone, _ = self.plans[plan_id]
+            self.schedule(plan_id, at, timezone, after=now)
+
+    async def run_forever(self, callback: Callable[[List[Tuple[int, str]]], Awaitable[None]]):
+        """Call back with each batch of due (plan_id, publish date), sleeping until the next is due."""
+        while True:
+            due = self.pop_due()
+            if due:
+                try:
+                    await callback(due)
+                except Exception:
+                    logger.exception('Timed publish for plans %s failed', due)
+                continue
+
+            fire_at = self.next_fire_at()
+            delay = MAX_SLEEP if fire_at is None else fire_at - self.clock.now().timestamp()
+            # Wake early if a plan is (re)scheduled in the meantime
+            self.changed.clear()
+            await self.clock.sleep(min(max(delay, 0), MAX_SLEEP), wake=self.changed)
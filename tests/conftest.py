@@ -0,0 +1,33 @@
+"""Shared setup: a scratch database, and the repository as the working directory.
+
+db.py opens its database when imported, so DB_PATH is pointed at a scratch
+file before any test module imports it.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+sys.path.insert(0, os.path.join(REPO_ROOT, 'bench'))
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix='mbrpgabot-tests-')
+os.environ['DB_PATH'] = os.path.join(SCRATCH_DIR, 'data.sqlite3')
+# Plans are read from plans/ and build/plans/ relative to the working directory
+os.chdir(REPO_ROOT)
+
+import db
+
+def pytest_unconfigure(config):
+    db.close_db()
+    shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+@pytest.fixture(autouse=True)
+def empty_db():
+    """Start every test with empty tables."""
+    with db.transaction() as conn:
+        for table in ('plans', 'deliveries', 'scheduler_runs', 'outbox'):
+            conn.execute(f'DELETE FROM {table}')
+    yield
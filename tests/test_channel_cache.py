@@ -0,0 +1,21 @@
+import asyncio
+import adb
+import db
+
+def test_read_racing_create_caches_the_plan_once():
+    adb.channel_cache.clear()
+    db.create_plan(7, 'mere_christianity')
+
+    async def race():
+        # The read lands on the db thread between create_plan's insert and its
+        # read back, so it sees the new row before the cache hears of it
+        create = asyncio.create_task(adb.create_plan(7, 'mcheyne'))
+        await asyncio.sleep(0)
+        await adb.get_plans_by_channel(7)
+        await create
+        return await adb.get_plans_by_channel(7)
+
+    plans = asyncio.run(race())
+
+    assert sorted(p['plan_type'] for p in plans) == ['mcheyne', 'mere_christianity']
+    assert sorted(p['plan_type'] for p in plans) == sorted(p['plan_type'] for p in db.get_plans_by_channel(7))
@@ -0,0 +1,55 @@
+import json
+import os
+import pytest
+import registry
+from chunker import iter_chunks, split_text
+from plan_store import MESSAGE_LIMIT
+
+def words(texts) -> str:
+    """All the non-whitespace text, in order."""
+    return ''.join(''.join(text.split()) for text in texts)
+
+@pytest.fixture(scope='module')
+def book_days():
+    with open(os.path.join(registry.PLANS_DIR, 'mere_christianity.json'), 'r') as f:
+        return json.load(f)['readings']
+
+def test_book_chunks_fit_and_keep_the_text(book_days):
+    for day in book_days:
+        chunks = list(iter_chunks(day))
+        assert all(0 < len(chunk) <= MESSAGE_LIMIT for chunk in chunks)
+        assert words(chunks) == words(day)
+
+@pytest.mark.parametrize('limit', [50, 200, 1000])
+def test_small_limits_fit_and_keep_the_text(book_days, limit):
+    day = book_days[0]
+    chunks = list(iter_chunks(day, limit=limit))
+    assert all(0 < len(chunk) <= limit for chunk in chunks)
+    assert words(chunks) == words(day)
+
+def test_overlong_word_is_split_mid_word():
+    assert list(split_text('a' * 4500)) == ['a' * 2000, 'a' * 2000, 'a' * 500]
+    assert list(split_text('x ' + 'a' * 30, limit=10)) == ['x', 'a' * 10, 'a' * 10, 'a' * 10]
+
+def test_split_prefers_sentence_then_whitespace():
+    text = 'One two three. Four five six seven'
+    assert list(split_text(text, limit=20)) == ['One two three.', 'Four five six seven']
+    assert list(split_text('aaa bbb ccc ddd', limit=10)) == ['aaa bbb', 'ccc ddd']
+
+def test_short_paragraph_is_returned_as_is():
+    assert list(split_text('Line one\n  line two')) == ['Line one\n  line two']
+
+def test_paragraphs_are_packed_while_they_fit():
+    assert list(iter_chunks(['a', 'b', 'c'])) == ['a\n\nb\n\nc']
+    assert list(iter_chunks(['aaaa', 'bbbb', 'cccc'], limit=10)) == ['aaaa\n\nbbbb', 'cccc']
+    assert list(iter_chunks(['a', 'b'], separator='\n')) == ['a\nb']
+
+def test_split_paragraph_continues_without_a_separator():
+    # The second piece of a split paragraph starts a new chunk rather than
+    # joining them with an invented paragraph break, even where both would fit
+    assert list(iter_chunks(['aaaa.      bbb'], limit=10)) == ['aaaa.', 'bbb']
+
+def test_blank_paragraphs_are_dropped():
+    assert list(iter_chunks(['   ', 'b', '\n\t'])) == ['b']
+    assert list(iter_chunks(['  '])) == []
+    assert list(iter_chunks([])) == []
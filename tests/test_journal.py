@@ -0,0 +1,83 @@
+import asyncio
+import pytest
+import adb
+import bot
+import db
+import publisher
+from fake_discord import FakeTransport
+
+PUBLISH_DATE = '2026-10-01'
+
+@pytest.fixture
+def transport(monkeypatch):
+    """A fake Discord that publish_readings sends through, without rate limits."""
+    transport = FakeTransport(latency=0)
+    monkeypatch.setattr(bot.bot, 'get_channel', transport.get_channel)
+    monkeypatch.setattr(publisher, 'GLOBAL_RATE', (10 ** 9, 1.0))
+    monkeypatch.setattr(publisher, 'CHANNEL_RATE', (10 ** 9, 1.0))
+    adb.channel_cache.clear()
+    return transport
+
+def fail_after(channel, sends: int):
+    """Make a fake channel's sends fail once it has received `sends` messages."""
+    send = channel.send
+
+    async def failing_send(*args, **kwargs):
+        if len(channel.messages) >= sends:
+            raise RuntimeError('connection lost')
+        await send(*args, **kwargs)
+
+    channel.send = failing_send
+    return send
+
+def publish():
+    asyncio.run(bot.publish_readings(PUBLISH_DATE, prerender=False))
+
+def test_interrupted_publish_resumes_without_repeats(transport):
+    book_id = db.create_plan(1, 'mere_christianity')
+    calendar_id = db.create_plan(2, 'mcheyne')
+    book, calendar = transport.get_channel(1), transport.get_channel(2)
+    send = fail_after(book, 1)
+
+    publish()
+
+    deliveries = {d['plan_id']: d for d in db.advance_plans({}, PUBLISH_DATE)}
+    assert list(deliveries) == [book_id]
+    # Counted in rendered payloads, several of which the first message may carry
+    assert deliveries[book_id]['sent'] > 0
+    expected, _, _ = bot.render_channel([{**deliveries[book_id], 'sent': 0}])
+    assert len(expected) > 1
+    assert book.messages == expected[:1]
+    assert len(calendar.messages) == 1
+
+    # Rerunning the date sends only what didn't go out, and advances nothing again
+    book.send = send
+    transport.reset()
+    publish()
+
+    assert book.messages == expected[1:]
+    assert calendar.messages == []
+    assert db.get_plan(book_id)['current_day'] == db.get_plan(calendar_id)['current_day'] == 1
+    assert db.advance_plans({}, PUBLISH_DATE) == []
+
+    transport.reset()
+    publish()
+    assert transport.requests == 0
+
+def test_paused_plan_is_journaled_without_advancing(transport):
+    plan_id = db.create_plan(1, 'mcheyne', current_day=5, paused=True)
+
+    publish()
+    publish()
+
+    assert db.get_plan(plan_id)['current_day'] == 5
+    assert len(transport.get_channel(1).messages) == 1
+
+def test_plan_past_its_end_wraps_once(transport):
+    length = bot.get_plan_length('mcheyne')
+    plan_id = db.create_plan(1, 'mcheyne', current_day=length - 1)
+
+    publish()
+    publish()
+
+    assert db.get_plan(plan_id)['current_day'] == 0
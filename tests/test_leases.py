@@ -0,0 +1,71 @@
+import db
+import registry
+
+PUBLISH_DATE = '2026-10-01'
+
+def queue(channels: int, publish_date: str = PUBLISH_DATE) -> int:
+    """Create a plan in each of some channels and queue their deliveries for a date."""
+    for channel_id in range(1, channels + 1):
+        db.create_plan(channel_id, 'mcheyne')
+    return db.enqueue_plans({'mcheyne': registry.PLANS['mcheyne'].length}, publish_date)
+
+def channels(deliveries):
+    return sorted(d['channel_id'] for d in deliveries)
+
+def test_leased_channels_are_not_claimed_twice():
+    assert queue(5) == 5
+
+    first = db.claim_deliveries('a', PUBLISH_DATE, 3, lease_seconds=60)
+    second = db.claim_deliveries('b', PUBLISH_DATE, 3, lease_seconds=60)
+
+    assert len(first) == 3 and len(second) == 2
+    assert set(channels(first)).isdisjoint(channels(second))
+    assert db.claim_deliveries('c', PUBLISH_DATE, 3, lease_seconds=60) == []
+    # Leased but unfinished deliveries still count as pending
+    assert db.count_pending_deliveries(PUBLISH_DATE) == 5
+
+def test_expired_lease_is_reclaimed():
+    queue(2)
+    # A worker that claimed and then died: its lease is already over
+    claimed = db.claim_deliveries('dead', PUBLISH_DATE, 10, lease_seconds=-1)
+
+    reclaimed = db.claim_deliveries('b', PUBLISH_DATE, 10, lease_seconds=60)
+
+    assert channels(reclaimed) == channels(claimed) == [1, 2]
+    assert all(d['leased_by'] == 'b' and d['attempts'] == 2 for d in reclaimed)
+    # The dead worker can't renew what it lost
+    assert db.renew_leases('dead', 60) == 0
+    assert db.renew_leases('b', 60) == 2
+
+def test_renewed_lease_is_kept():
+    queue(1)
+    db.claim_deliveries('a', PUBLISH_DATE, 10, lease_seconds=-1)
+    db.renew_leases('a', 60)
+    assert db.claim_deliveries('b', PUBLISH_DATE, 10, lease_seconds=60) == []
+
+def test_released_and_sent_deliveries():
+    queue(2)
+    claimed = db.claim_deliveries('a', PUBLISH_DATE, 10, lease_seconds=60)
+    db.mark_delivery_sent(claimed[0]['plan_id'], PUBLISH_DATE, 1, completed=True)
+
+    # Only the unfinished one goes back in the queue
+    assert db.release_deliveries('a') == 1
+    assert channels(db.claim_deliveries('b', PUBLISH_DATE, 10, lease_seconds=60)) == [claimed[1]['channel_id']]
+
+def test_delivery_is_given_up_after_max_attempts():
+    queue(1)
+    for _ in range(db.MAX_DELIVERY_ATTEMPTS):
+        assert len(db.claim_deliveries('a', PUBLISH_DATE, 10, lease_seconds=-1)) == 1
+
+    assert db.claim_deliveries('a', PUBLISH_DATE, 10, lease_seconds=-1) == []
+    assert db.count_pending_deliveries(PUBLISH_DATE) == 0
+
+def test_only_the_given_date_is_claimed():
+    queue(2, '2026-09-30')
+    db.enqueue_plans({'mcheyne': registry.PLANS['mcheyne'].length}, PUBLISH_DATE)
+
+    claimed = db.claim_deliveries('a', PUBLISH_DATE, 10, lease_seconds=60)
+
+    assert {d['publish_date'] for d in claimed} == {PUBLISH_DATE}
+    assert db.count_pending_deliveries('2026-09-30') == 2
+    assert db.claim_deliveries('a', PUBLISH_DATE, 10, lease_seconds=60) == []
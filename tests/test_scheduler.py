@@ -0,0 +1,169 @@
+import asyncio
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+import pytest
+from scheduler import DailyScheduler, FakeClock, PlanTimers
+
+SIX = time(6, 0)
+NEW_YORK = ZoneInfo('America/New_York')
+
+def local(*args) -> datetime:
+    return datetime(*args).astimezone()
+
+def make_scheduler(clock, last_run, max_catch_up=1):
+    """A DailyScheduler at 06:00 recording each slot it fires and each last run it saves."""
+    fired, saved = [], []
+    state = {'last_run': last_run}
+
+    async def callback(slot):
+        fired.append(slot)
+
+    async def load_last_run():
+        return state['last_run']
+
+    async def save_last_run(value):
+        state['last_run'] = value
+        saved.append(value)
+
+    scheduler = DailyScheduler([SIX], callback, load_last_run, save_last_run, clock=clock, max_catch_up=max_catch_up)
+    return scheduler, fired, saved
+
+def test_first_start_records_now_without_running():
+    clock = FakeClock(local(2026, 3, 1, 7, 0))
+    scheduler, fired, saved = make_scheduler(clock, None)
+
+    assert asyncio.run(scheduler.run_due(None)) == clock.now()
+    assert fired == []
+    assert saved == [clock.now()]
+
+@pytest.mark.parametrize('max_catch_up, expected_days', [(0, []), (1, [4]), (2, [3, 4]), (10, [2, 3, 4])])
+def test_catch_up_runs_only_the_latest_missed_slots(max_catch_up, expected_days):
+    # Down from just after the 06:00 run on the 1st until 07:00 on the 4th
+    clock = FakeClock(local(2026, 3, 4, 7, 0))
+    last_run = local(2026, 3, 1, 6, 0)
+    scheduler, fired, saved = make_scheduler(clock, last_run, max_catch_up)
+
+    new_last_run = asyncio.run(scheduler.run_due(last_run))
+
+    assert fired == [local(2026, 3, day, 6, 0) for day in expected_days]
+    # Skipped slots count as run, so they aren't caught up on again
+    assert new_last_run == saved[-1] == local(2026, 3, 4, 6, 0)
+
+def test_nothing_due_before_the_next_slot():
+    clock = FakeClock(local(2026, 3, 1, 12, 0))
+    last_run = local(2026, 3, 1, 6, 0)
+    scheduler, fired, saved = make_scheduler(clock, last_run)
+
+    assert asyncio.run(scheduler.run_due(last_run)) == last_run
+    assert fired == saved == []
+
+def test_failed_run_is_still_recorded():
+    clock = FakeClock(local(2026, 3, 2, 7, 0))
+    last_run = local(2026, 3, 1, 6, 0)
+    saved = []
+
+    async def fail(slot):
+        raise RuntimeError('send failed')
+
+    async def save(value):
+        saved.append(value)
+
+    scheduler = DailyScheduler([SIX], fail, None, save, clock=clock)
+    asyncio.run(scheduler.run_due(last_run))
+    assert saved[-1] == local(2026, 3, 2, 6, 0)
+
+def test_run_forever_fires_each_day():
+    clock = FakeClock(local(2026, 3, 1, 7, 0))
+    scheduler, fired, _ = make_scheduler(clock, local(2026, 3, 1, 6, 0))
+    callback = scheduler.callback
+
+    async def stop_after_three(slot):
+        await callback(slot)
+        if len(fired) == 3:
+            raise asyncio.CancelledError
+
+    scheduler.callback = stop_after_three
+    with pytest.raises(asyncio.CancelledError):
+        asyncio.run(scheduler.run_forever())
+    assert fired == [local(2026, 3, day, 6, 0) for day in (2, 3, 4)]
+
+def run_timers(timers, clock, until: datetime):
+    """Advance the clock from one due plan to the next until `until`, returning (plan_id, date, local fire time)."""
+    fired = []
+    while True:
+        fire_at = timers.next_fire_at()
+        if fire_at is None or fire_at > until.timestamp():
+            return fired
+        clock.current = datetime.fromtimestamp(fire_at, timezone.utc)
+        fired.extend((plan_id, publish_date, clock.now()) for plan_id, publish_date in timers.pop_due())
+
+def test_plan_timers_keep_local_time_across_dst():
+    # Clocks in New York go forward on 2026-03-08 and back on 2026-11-01
+    for start in (datetime(2026, 3, 6, 12, tzinfo=NEW_YORK), datetime(2026, 10, 30, 12, tzinfo=NEW_YORK)):
+        clock = FakeClock(start)
+        timers = PlanTimers(clock=clock)
+        timers.schedule(1, SIX, 'America/New_York')
+
+        fired = run_timers(timers, clock, start + timedelta(days=4))
+
+        assert [when.astimezone(NEW_YORK).time() for _, _, when in fired] == [SIX] * 4
+        assert [publish_date for _, publish_date, _ in fired] == [
+            (start + timedelta(days=n)).date().isoformat() for n in range(1, 5)]
+        gaps = {(b - a).total_seconds() / 3600 for (_, _, a), (_, _, b) in zip(fired, fired[1:])}
+        # One day is an hour shorter or longer than the rest
+        assert gaps in ({24, 23}, {24, 25})
+
+def test_plan_timers_skip_a_nonexistent_local_time():
+    # 02:30 doesn't happen on 2026-03-08 in New York; the plan still publishes once that day
+    start = datetime(2026, 3, 7, 12, tzinfo=NEW_YORK)
+    clock = FakeClock(start)
+    timers = PlanTimers(clock=clock)
+    timers.schedule(1, time(2, 30), 'America/New_York')
+
+    fired = run_timers(timers, clock, start + timedelta(days=3))
+    assert [publish_date for _, publish_date, _ in fired] == ['2026-03-08', '2026-03-09', '2026-03-10']
+
+def test_jitter_is_stable_and_bounded():
+    start = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+    clock = FakeClock(start)
+    timers = PlanTimers(clock=clock, jitter=60)
+    for plan_id in range(1, 21):
+        timers.schedule(plan_id, SIX, 'UTC')
+
+    fired = run_timers(timers, clock, start + timedelta(days=2))
+
+    assert len(fired) == 40
+    offsets = {}
+    for plan_id, publish_date, when in fired:
+        offset = (when - datetime.combine(when.date(), SIX, tzinfo=timezone.utc)).total_seconds()
+        assert 0 <= offset <= 60
+        assert publish_date == when.date().isoformat()
+        offsets.setdefault(plan_id, set()).add(offset)
+    # Each plan keeps its offset from day to day, and plans don't all share one
+    assert all(len(o) == 1 for o in offsets.values())
+    assert len({o.pop() for o in offsets.values()}) > 1
+
+def test_jitter_past_midnight_keeps_the_publish_date():
+    timers = PlanTimers(jitter=600)
+    # A plan whose offset pushes a 23:55 publish into the next day
+    plan_id = next(p for p in range(1, 1000) if timers.offset(p) > timedelta(minutes=5))
+    start = datetime(2026, 3, 1, 12, tzinfo=timezone.utc)
+    clock = timers.clock = FakeClock(start)
+    timers.schedule(plan_id, time(23, 55), 'UTC')
+
+    fired = run_timers(timers, clock, start + timedelta(days=2))
+
+    assert [publish_date for _, publish_date, _ in fired] == ['2026-03-01', '2026-03-02']
+    assert [when.date().isoformat() for _, _, when in fired] == ['2026-03-02', '2026-03-03']
+
+def test_rescheduled_and_cancelled_plans_fire_only_as_set():
+    start = datetime(2026, 3, 1, 0, tzinfo=timezone.utc)
+    clock = FakeClock(start)
+    timers = PlanTimers(clock=clock)
+    timers.schedule(1, SIX, 'UTC')
+    timers.schedule(2, SIX, 'UTC')
+    timers.schedule(1, time(8, 0), 'UTC')
+    timers.cancel(2)
+
+    fired = run_timers(timers, clock, start + timedelta(days=1))
+    assert [(plan_id, when.time()) for plan_id, _, when in fired] == [(1, time(8, 0))]